@@ -37,6 +37,37 @@ import time
 import sys
 import math
 
+# Per-byte bookkeeping for text, shared by Adafruit_Thermal.write() and
+# Receipt.write() (see receipt.py) so the two can't disagree on timing.
+# 'state' is either of them: its column and prevByte are advanced for
+# byte c, using its character size and timing calibration.  Returns the
+# estimated time to print c (including its line's print or feed time,
+# if c ends a line) and whether it ended a line.
+def textByteTime(state, c):
+	d = state.byteTime
+	lineEnded = ((c == 10) or (state.column == state.maxColumn))
+	if lineEnded:
+		# Newline or wrap
+		if state.prevByte == '\n':
+			# Feed line (blank)
+			d += ((state.charHeight +
+			       state.lineSpacing) *
+			      state.dotFeedTime)
+		else:
+			# Text line
+			d += ((state.charHeight *
+			       state.dotPrintTime) +
+			      (state.lineSpacing *
+			       state.dotFeedTime))
+			state.column = 0
+			# Treat wrap as newline
+			# on next pass
+			c = 10
+	else:
+		state.column += 1
+	state.prevByte = chr(c)
+	return d, lineEnded
+
 class Adafruit_Thermal(Serial):
 
 	resumeTime      =   0.0
@@ -150,14 +181,33 @@ class Adafruit_Thermal(Serial):
 	# (e.g. receiving or decoding an image) while the printer
 	# physically completes the task.
 
+	# Deadlines use the monotonic clock so that wall-clock adjustments
+	# (e.g. NTP syncing after the Pi joins a network) can't stall or rush
+	# the printer.  Waiting sleeps until spinTime before the deadline and
+	# only busy-waits for that last sliver, which keeps the CPU free for
+	# the camera and network threads.  waitTotal and spinTotal accumulate
+	# the seconds spent sleeping and spinning respectively.
+
+	spinTime  = 0.002
+	waitTotal =   0.0
+	spinTotal =   0.0
+
 	# Sets estimated completion time for a just-issued task.
 	def timeoutSet(self, x):
-		self.resumeTime = time.time() + x
+		self.resumeTime = time.monotonic() + x
 
 	# Waits (if necessary) for the prior task to complete.
 	def timeoutWait(self):
 		if self.writeToStdout is False:
-			while (time.time() - self.resumeTime) < 0: pass
+			start     = time.monotonic()
+			remaining = self.resumeTime - start
+			if remaining > self.spinTime:
+				time.sleep(remaining - self.spinTime)
+				now = time.monotonic()
+				self.waitTotal += now - start
+				start = now
+			while time.monotonic() < self.resumeTime: pass
+			self.spinTotal += time.monotonic() - start
 
 	# Printer performance may vary based on the power supply voltage,
 	# thickness of paper, phase of the moon and other seemingly random
@@ -176,50 +226,75 @@ class Adafruit_Thermal(Serial):
 		self.dotPrintTime = p / 1000000.0
 		self.dotFeedTime  = f / 1000000.0
 
-	# 'Raw' byte-writing method
+	# 'Raw' byte-writing method.  All bytes of a command are issued
+	# with a single serial write once the prior task has completed.
 	def writeBytes(self, *args):
 		if self.writeToStdout:
 			for arg in args:
 				sys.stdout.write(bytes([arg]))
 		else:
-			for arg in args:
-				self.timeoutWait()
-				self.timeoutSet(len(args) * self.byteTime)
-				super(Adafruit_Thermal, self).write(bytes([arg]))
+			self.timeoutWait()
+			super(Adafruit_Thermal, self).write(bytes(args))
+			self.timeoutSet(len(args) * self.byteTime)
+
+	# Override write() method to keep track of paper feed.  Rather than
+	# issuing one byte at a time, text is gathered into runs of up to
+	# maxChunkBytes (a conservative fraction of the printer's input
+	# buffer) while the time to print each run is totted up using the
+	# same per-byte and per-line math as before (textByteTime(), which
+	# Receipt shares).  Each run then goes
+	# out in a single serial write, after which a timeout is set for
+	# the whole run.
+	maxChunkBytes = 256
 
-	# Override write() method to keep track of paper feed.
 	def write(self, *data):
-		for i in range(len(data)):
-			c = data[i]
+		for arg in data:
 			if self.writeToStdout:
-				sys.stdout.write(c)
+				sys.stdout.write(arg)
 				continue
-			if c != 0x13:
-				self.timeoutWait()
-				super(Adafruit_Thermal, self).write(c)
-				d = self.byteTime
-				if ((c == '\n') or
-				    (self.column == self.maxColumn)):
-					# Newline or wrap
-					if self.prevByte == '\n':
-						# Feed line (blank)
-						d += ((self.charHeight +
-						       self.lineSpacing) *
-						      self.dotFeedTime)
-					else:
-						# Text line
-						d += ((self.charHeight *
-						       self.dotPrintTime) +
-						      (self.lineSpacing *
-						       self.dotFeedTime))
-						self.column = 0
-						# Treat wrap as newline
-						# on next pass
-						c = '\n'
-				else:
-					self.column += 1
-				self.timeoutSet(d)
-				self.prevByte = c
+			if isinstance(arg, int):
+				arg = bytes([arg])
+			chunk = bytearray()
+			d     = 0.0
+			for c in arg:
+				if c == 0x13: continue
+				chunk.append(c)
+				d += textByteTime(self, c)[0]
+				if len(chunk) >= self.maxChunkBytes:
+					self.writeChunk(chunk, d)
+					chunk = bytearray()
+					d     = 0.0
+			if chunk:
+				self.writeChunk(chunk, d)
+
+	# Issues a pre-built run of bytes once the prior task has completed,
+	# then sets the estimated time for the printer to get through it.
+	def writeChunk(self, chunk, d):
+		self.timeoutWait()
+		super(Adafruit_Thermal, self).write(chunk)
+		self.timeoutSet(d)
+
+	# Prints a receipt compiled ahead of time (see receipt.py).  Its
+	# bytes go out in runs of up to maxChunkBytes, split at the line
+	# and command boundaries the receipt recorded, each paced by that
+	# run's share of the receipt's precomputed print time.
+	def writeCompiled(self, receipt):
+		data = memoryview(receipt.data)
+		if self.writeToStdout:
+			sys.stdout.write(data)
+		else:
+			start = end = 0
+			startTime = endTime = 0.0
+			for offset, t in receipt.marks + [(len(data), receipt.printTime)]:
+				if offset - start > self.maxChunkBytes and end > start:
+					self.writeChunk(data[start:end], endTime - startTime)
+					start, startTime = end, endTime
+				end, endTime = offset, t
+			if end > start:
+				self.writeChunk(data[start:end], endTime - startTime)
+		self.lineSpacing = receipt.lineSpacing
+		self.column      = receipt.column
+		self.prevByte    = receipt.prevByte
 
 	# The bulk of this method was moved into __init__,
 	# but this is left here for compatibility with older
@@ -518,7 +593,10 @@ class Adafruit_Thermal(Serial):
 		if LaaT: maxChunkHeight = 1
 		else:    maxChunkHeight = 255
 
-		i = 0
+		# Each chunk goes out as one write: a view straight into
+		# the bitmap when rows don't need clipping, otherwise the
+		# rows' first rowBytesClipped bytes joined together.
+		bits = memoryview(bytes(bitmap) if isinstance(bitmap, list) else bitmap)
 		for rowStart in range(0, h, maxChunkHeight):
 			chunkHeight = h - rowStart
 			if chunkHeight > maxChunkHeight:
@@ -527,15 +605,17 @@ class Adafruit_Thermal(Serial):
 			# Timeout wait happens here
 			self.writeBytes(18, 42, chunkHeight, rowBytesClipped)
 
-			for y in range(chunkHeight):
-				for x in range(rowBytesClipped):
-					if self.writeToStdout:
-						sys.stdout.write(bytes([bitmap[i]]))
-					else:
-						super(Adafruit_Thermal,
-						  self).write(bytes([bitmap[i]]))
-					i += 1
-				i += rowBytes - rowBytesClipped
+			start = rowStart * rowBytes
+			end   = start + chunkHeight * rowBytes
+			if rowBytesClipped == rowBytes:
+				chunk = bits[start:end]
+			else:
+				chunk = b''.join(bits[n:n + rowBytesClipped]
+				  for n in range(start, end, rowBytes))
+			if self.writeToStdout:
+				sys.stdout.write(chunk)
+			else:
+				super(Adafruit_Thermal, self).write(chunk)
 			self.timeoutSet(chunkHeight * self.dotPrintTime)
 
 		self.prevByte = '\n'
@@ -557,6 +637,34 @@ class Adafruit_Thermal(Serial):
 		height = image.size[1]
 		if width > 384:
 			width = 384
+		bitmap = self.packImage(image, width)
+
+		self.printBitmap(width, height, bitmap, LaaT)
+
+	# Packs a mode '1' image into the row-aligned bitmap format
+	# expected by printBitmap(), clipped to 'width' pixels.  PIL
+	# already stores such images as MSB-first rows padded to a byte
+	# boundary, so this is just those bytes with the bits inverted
+	# (PIL uses 1 for white, the printer 1 for black) and the padding
+	# bits at the end of each row cleared.  Requires NumPy.
+	@staticmethod
+	def packImage(image, width):
+		import numpy
+		rowBytes = (width + 7) // 8
+		if image.size[0] != width:
+			image = image.crop((0, 0, width, image.size[1]))
+		rows = numpy.frombuffer(image.tobytes(), dtype=numpy.uint8)
+		rows = numpy.invert(rows.reshape(-1, rowBytes))
+		if width & 7:
+			rows[:, -1] &= (0xFF << (8 - (width & 7))) & 0xFF
+		return bytearray(rows.tobytes())
+
+	# Pixel-at-a-time equivalent of packImage(), as originally ported.
+	# Much slower, but kept as the reference the packed output is
+	# checked against (see benchimage.py).
+	@staticmethod
+	def packImageLoop(image, width):
+		height   = image.size[1]
 		rowBytes = math.floor((width + 7) / 8)
 		bitmap   = bytearray(rowBytes * height)
 		pixels   = image.load()
@@ -575,7 +683,7 @@ class Adafruit_Thermal(Serial):
 					bit >>= 1
 				bitmap[n + b] = sum
 
-		self.printBitmap(width, height, bitmap, LaaT)
+		return bitmap
 
 	# Take the printer offline. Print commands sent after this
 	# will be ignored until 'online' is called.
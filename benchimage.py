@@ -0,0 +1,59 @@
+# Compares the two ways of packing an image into a printer bitmap:
+# Adafruit_Thermal.packImageLoop() (one Python-level pixel read at a time,
+# as originally ported) and Adafruit_Thermal.packImage() (PIL tobytes() +
+# NumPy).  Checks that both produce identical bytes at each size, then
+# prints the average time per image for each.
+#
+# Usage: python benchimage.py [repeats]
+# No printer is needed.
+
+import sys, time, random
+
+from PIL import Image
+from Adafruit_Thermal import Adafruit_Thermal
+
+# (width, height) -- includes widths that aren't a multiple of 8 and
+# images wider than the printer, which get clipped to 384 pixels
+sizes = [(96, 100), (203, 150), (384, 400), (384, 800), (512, 384)]
+
+
+# Random greyscale noise dithered to 1-bit, so every packed byte varies
+def make_image(width, height):
+  rng = random.Random(width * height)
+  noise = bytes(rng.getrandbits(8) for i in range(width * height))
+  return Image.frombytes('L', (width, height), noise).convert('1')
+
+
+# One untimed call first, so one-off costs like importing NumPy
+# don't land on whichever size happens to be measured first
+def time_it(fn, repeats):
+  fn()
+  start = time.perf_counter()
+  for i in range(repeats):
+    result = fn()
+  return (time.perf_counter() - start) / repeats, result
+
+
+def main():
+  repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+
+  print('%-10s %12s %12s %9s' % ('size', 'loop (ms)', 'packed (ms)', 'speedup'))
+  for width, height in sizes:
+    image = make_image(width, height)
+    clipped = min(width, 384)
+
+    loop_time, expected = time_it(
+      lambda: Adafruit_Thermal.packImageLoop(image, clipped), repeats)
+    packed_time, actual = time_it(
+      lambda: Adafruit_Thermal.packImage(image, clipped), repeats)
+
+    if actual != expected:
+      raise SystemExit('packed bitmap differs from reference at %dx%d' % (width, height))
+
+    print('%-10s %12.2f %12.2f %8.1fx' % (
+      '%dx%d' % (width, height),
+      loop_time * 1000, packed_time * 1000, loop_time / packed_time))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,172 @@
+# Print-throughput benchmarks for the Adafruit_Thermal driver. Each case
+# runs the real driver against the printer emulator (thermalemulator.py)
+# and records:
+#
+#   bytes            bytes the printer received
+#   bytes_per_sec    bytes / wall-clock seconds spent in the driver
+#   serial_writes    Serial.write() calls (roughly, syscalls) for the case
+#   cpu_sec          CPU time used by the driver's thread
+#   estimated_sec    print time the driver estimated via timeoutSet()
+#   modelled_sec     print time according to the emulator's printer model
+#   gap_sec          estimated_sec - modelled_sec (negative means the driver
+#                    thinks the printer is done before it really is)
+#   overruns         bytes that arrived with the printer's buffer full
+#
+# Results are written as JSON so runs can be compared:
+#
+#   python benchprinter.py --output before.json
+#   ...change the driver...
+#   python benchprinter.py --output after.json --compare before.json
+#
+# Real printers are slow (a 400-row image takes ~12s), so by default all
+# printer timings -- dot print/feed times and the serial byte time -- are
+# scaled down by --time-scale. Requires Pillow and NumPy.
+
+import argparse, io, json, platform, time
+
+from serial import Serial
+from Adafruit_Thermal import Adafruit_Thermal
+from thermalemulator import ThermalEmulator
+from wraptext import wrap_text
+
+POEM = """The bus stop keeps its own small weather,
+a puddle holding half the sky.
+Your umbrella leans against the bench
+like a friend who stayed too long,
+and the schedule, peeling at one corner,
+promises a seven-fifteen
+that you and I have both stopped believing in,
+though we still check our watches when it's late."""
+
+IMAGE_SIZES = [(128, 128), (384, 200), (384, 400)]
+
+
+# Counts serial writes. The driver calls super(Adafruit_Thermal, self).write(),
+# which lands here when this class sits between it and Serial.
+class CountingSerial(Serial):
+  writes = 0
+
+  def write(self, data):
+    self.writes += 1
+    return Serial.write(self, data)
+
+
+class BenchPrinter(Adafruit_Thermal, CountingSerial):
+  pass
+
+
+def make_image(width, height):
+  from PIL import Image
+  # diagonal gradient, dithered by printImage
+  gradient = bytes((x + y) * 255 // (width + height) for y in range(height) for x in range(width))
+  buffer = io.BytesIO()
+  Image.frombytes('L', (width, height), gradient).save(buffer, 'PNG')
+  buffer.seek(0)
+  return buffer
+
+
+def run_case(fn, baudrate, scale):
+  emulator = ThermalEmulator(baudrate=baudrate / scale,
+                             dotPrintTime=0.03 * scale, dotFeedTime=0.0021 * scale)
+  printer = BenchPrinter(emulator.port, baudrate)
+  printer.byteTime *= scale
+  printer.setTimes(30000 * scale, 2100 * scale)
+  # let setup commands drain so they aren't counted
+  printer.timeoutWait()
+  emulator.settle()
+  start_bytes = emulator.stats()['bytes']
+  printer.writes = 0
+  printer.waitTotal = printer.spinTotal = 0.0
+
+  start = time.monotonic()
+  cpu = time.thread_time()
+  fn(printer)
+  printer.timeoutWait()
+  cpu = time.thread_time() - cpu
+  wall = time.monotonic() - start
+  estimated = printer.resumeTime - start
+
+  emulator.settle()
+  stats = emulator.stats()
+  printer.close()
+  emulator.close()
+
+  received = stats['bytes'] - start_bytes
+  modelled = stats['print_end'] - start
+  return {
+    'bytes': received,
+    'bytes_per_sec': round(received / wall, 1),
+    'serial_writes': printer.writes,
+    'cpu_sec': round(cpu, 4),
+    'wait_sec': round(printer.waitTotal, 4),
+    'spin_sec': round(printer.spinTotal, 4),
+    'wall_sec': round(wall, 4),
+    'estimated_sec': round(estimated, 4),
+    'modelled_sec': round(modelled, 4),
+    'gap_sec': round(estimated - modelled, 4),
+    'overruns': stats['overruns'],
+    'peak_buffer_bytes': stats['peak_buffer_bytes'],
+  }
+
+
+def cases():
+  yield 'text_poem', lambda printer: printer.println(wrap_text(POEM, 32))
+  for width, height in IMAGE_SIZES:
+    image = make_image(width, height)
+    def print_image(printer, image=image):
+      image.seek(0)
+      printer.printImage(image)
+    yield 'image_%dx%d' % (width, height), print_image
+  yield 'barcode_code128', lambda printer: printer.printBarcode('POETRY-CAMERA', printer.CODE128)
+
+
+def compare(results, baseline):
+  print()
+  print('%-18s %-15s %12s %12s %8s' % ('case', 'metric', 'before', 'after', 'change'))
+  for name, metrics in results['cases'].items():
+    before = baseline['cases'].get(name)
+    if not before:
+      continue
+    for key in ('bytes_per_sec', 'serial_writes', 'cpu_sec', 'gap_sec', 'overruns'):
+      old, new = before.get(key), metrics[key]
+      change = '%+.0f%%' % ((new - old) * 100.0 / old) if old else ''
+      print('%-18s %-15s %12s %12s %8s' % (name, key, old, new, change))
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Print-throughput benchmarks for Adafruit_Thermal")
+  parser.add_argument('--baudrate', type=int, default=19200)
+  parser.add_argument('--time-scale', type=float, default=0.05,
+                      help='multiplier for all printer timings (1.0 = real time)')
+  parser.add_argument('--output', default='bench_printer.json')
+  parser.add_argument('--compare', help='earlier results file to compare against')
+  args = parser.parse_args()
+
+  results = {
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'python': platform.python_version(),
+    'machine': platform.machine(),
+    'baudrate': args.baudrate,
+    'time_scale': args.time_scale,
+    'cases': {},
+  }
+  print('%-18s %8s %10s %7s %8s %9s %9s %8s' % (
+    'case', 'bytes', 'bytes/s', 'writes', 'cpu(s)', 'est(s)', 'model(s)', 'overrun'))
+  for name, fn in cases():
+    metrics = run_case(fn, args.baudrate, args.time_scale)
+    results['cases'][name] = metrics
+    print('%-18s %8d %10.0f %7d %8.3f %9.3f %9.3f %8d' % (
+      name, metrics['bytes'], metrics['bytes_per_sec'], metrics['serial_writes'],
+      metrics['cpu_sec'], metrics['estimated_sec'], metrics['modelled_sec'], metrics['overruns']))
+
+  with open(args.output, 'w') as f:
+    json.dump(results, f, indent=2)
+  print('results written to ' + args.output)
+
+  if args.compare:
+    with open(args.compare) as f:
+      compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+  main()
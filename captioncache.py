@@ -0,0 +1,86 @@
+# Caption cache for scenes that get photographed over and over (the same
+# wall, sign or table at an installation). Captions are stored by the
+# perceptual hash of the photo (see scenehash.py); a new photo whose hash
+# is within 'threshold' bits of a cached one reuses its caption instead of
+# calling the captioning model.
+#
+# Entries live in a small SQLite file so they survive restarts. Once there
+# are more than max_entries, the least recently used are dropped. Lookups
+# scan an in-memory copy of the hashes, which is a few hundred
+# microseconds for the default size; stats() reports the actual cost.
+
+import sqlite3, threading, time
+
+from scenehash import hamming
+
+
+# SQLite integers are signed 64-bit; hashes are unsigned
+def to_signed(value):
+  return value - (1 << 64) if value >= (1 << 63) else value
+
+def to_unsigned(value):
+  return value + (1 << 64) if value < 0 else value
+
+
+class CaptionCache:
+  def __init__(self, path, max_entries=500, threshold=6):
+    self.max_entries = max_entries
+    self.threshold = threshold
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute('''CREATE TABLE IF NOT EXISTS captions (
+      hash INTEGER PRIMARY KEY, caption TEXT NOT NULL, last_used REAL NOT NULL)''')
+    self.db.commit()
+    # hash -> [caption, last_used]
+    self.entries = {to_unsigned(h): [caption, last_used] for h, caption, last_used
+                    in self.db.execute('SELECT hash, caption, last_used FROM captions')}
+
+    self.hits = 0
+    self.misses = 0
+    self.lookup_time = 0.0
+
+  # Caption of the closest cached scene within 'threshold' bits, or None
+  def lookup(self, frame_hash):
+    started = time.perf_counter()
+    with self.lock:
+      best, distance = None, self.threshold + 1
+      for h in self.entries:
+        d = hamming(frame_hash, h)
+        if d < distance:
+          best, distance = h, d
+      if best is None:
+        self.misses += 1
+        self.lookup_time += time.perf_counter() - started
+        return None
+
+      entry = self.entries[best]
+      entry[1] = time.time()
+      self.db.execute('UPDATE captions SET last_used = ? WHERE hash = ?', (entry[1], to_signed(best)))
+      self.db.commit()
+      self.hits += 1
+      self.lookup_time += time.perf_counter() - started
+      return entry[0]
+
+  def add(self, frame_hash, caption):
+    with self.lock:
+      now = time.time()
+      self.entries[frame_hash] = [caption, now]
+      self.db.execute('INSERT OR REPLACE INTO captions VALUES (?, ?, ?)',
+                      (to_signed(frame_hash), caption, now))
+      if len(self.entries) > self.max_entries:
+        oldest = sorted(self.entries, key=lambda h: self.entries[h][1])
+        for h in oldest[:len(self.entries) - self.max_entries]:
+          del self.entries[h]
+          self.db.execute('DELETE FROM captions WHERE hash = ?', (to_signed(h),))
+      self.db.commit()
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'entries': len(self.entries),
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        'avg_lookup_ms': round(self.lookup_time * 1000 / lookups, 3) if lookups else None,
+      }
@@ -0,0 +1,290 @@
+# Camera capture helpers.
+
+import io, os, time, threading, traceback
+from collections import deque
+from datetime import datetime
+
+# How big a photo each backend gets: longest side in pixels, and a byte
+# budget for the JPEG. The captioning models only look at a few hundred
+# pixels, and on weak wifi the upload is the slowest part of the trip,
+# so there's no point sending the camera's full resolution.
+UPLOAD_PROFILES = {
+  'blip2': {'max_side': 512, 'max_bytes': 60000},
+  'pic_to_poem': {'max_side': 768, 'max_bytes': 120000},
+}
+
+
+# Waits for the camera to settle after picam2.start(), instead of always
+# sleeping for a fixed time. The first frames are often poorly exposed
+# while auto exposure and white balance find their feet; they count as
+# settled once exposure time, analogue gain and colour gains have each
+# changed by less than 'tolerance' (relative) for 'stable_frames' frames
+# in a row, and the camera reports AeLocked (when it reports it at all).
+# Gives up after 'timeout' seconds. Logs and returns the time it took.
+def wait_for_convergence(picam2, timeout=2.0, stable_frames=3, tolerance=0.02):
+  started = time.monotonic()
+  previous = None
+  stable = 0
+  converged = False
+
+  while time.monotonic() - started < timeout:
+    metadata = picam2.capture_metadata()
+    values = [metadata.get('ExposureTime', 0), metadata.get('AnalogueGain', 0)]
+    values += list(metadata.get('ColourGains', ()))
+    if previous is not None and len(values) == len(previous) and all(
+        abs(value - old) <= tolerance * max(abs(old), 1e-6)
+        for value, old in zip(values, previous)):
+      stable += 1
+    else:
+      stable = 0
+    previous = values
+    if stable >= stable_frames and metadata.get('AeLocked', True):
+      converged = True
+      break
+
+  elapsed = time.monotonic() - started
+  print('----- CAMERA READY: %s after %.2fs' % (
+    'exposure settled' if converged else 'timed out', elapsed))
+  return elapsed
+
+
+# Takes a photo and encodes it as a JPEG straight into memory, skipping the
+# SD card. Returns the in-memory file (rewound, ready to upload) and the
+# capture metadata.
+def capture_jpeg(picam2):
+  image = io.BytesIO()
+  metadata = picam2.capture_file(image, format='jpeg')
+  # upload clients guess the content type from the file name
+  image.name = 'image.jpg'
+  image.seek(0)
+  return image, metadata
+
+
+# Takes a photo as a raw frame -- so no full-size JPEG is ever encoded --
+# and returns a JPEG of it sized for upload (see encode_for_upload), the
+# full-size frame as a PIL image, and the capture metadata.
+def capture_for_upload(picam2, profile):
+  request = picam2.capture_request()
+  try:
+    frame = request.make_image('main')
+    metadata = request.get_metadata()
+  finally:
+    request.release()
+  return encode_for_upload(frame, **profile), frame, metadata
+
+
+# Shrinks a PIL image so its longest side is at most max_side, then
+# encodes it as a JPEG, lowering the quality step by step until it fits
+# in max_bytes (or min_quality is reached). Logs the result. With no
+# max_side/max_bytes the frame is encoded at full size and quality.
+def encode_for_upload(frame, max_side=None, max_bytes=None, quality=85, min_quality=45):
+  from PIL import Image
+
+  started = time.monotonic()
+  max_side = max_side or max(frame.size)
+  max_bytes = max_bytes or float('inf')
+  scale = min(1.0, float(max_side) / max(frame.size))
+  size = (max(1, round(frame.width * scale)), max(1, round(frame.height * scale)))
+  small = frame.convert('RGB').resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+  while True:
+    image = io.BytesIO()
+    small.save(image, 'JPEG', quality=quality)
+    if image.tell() <= max_bytes or quality <= min_quality:
+      break
+    quality -= 10
+
+  print('----- UPLOAD IMAGE: %dx%d, %d KB at quality %d, encoded in %.3fs' % (
+    size[0], size[1], image.tell() // 1024, quality, time.monotonic() - started))
+  image.name = 'image.jpg'
+  image.seek(0)
+  return image
+
+
+# How sharp a frame is: the variance of the Laplacian of its luma. Blurry
+# frames have soft edges, so a small Laplacian everywhere and a low
+# variance. To keep this fast, only every step-th pixel of the green
+# channel (a close enough stand-in for luma) is used.
+def sharpness(array, step=4):
+  import numpy
+  if array.ndim == 3:
+    array = array[:, :, 1]
+  luma = array[::step, ::step].astype(numpy.int32)
+  laplacian = (4 * luma[1:-1, 1:-1] - luma[:-2, 1:-1] - luma[2:, 1:-1]
+               - luma[1:-1, :-2] - luma[1:-1, 2:])
+  return float(laplacian.var())
+
+
+# Index of the sharpest of a list of frames (numpy arrays). Logs every
+# frame's score and how long scoring took.
+def pick_sharpest(arrays):
+  started = time.monotonic()
+  scores = [sharpness(array) for array in arrays]
+  best = scores.index(max(scores))
+  print('----- BURST: sharpness %s, picked frame %d (scored in %.1f ms)' % (
+    ', '.join('%.0f' % score for score in scores), best,
+    (time.monotonic() - started) * 1000))
+  return best
+
+
+# Burst mode for hand-held shots: grabs 'frames' frames from the running
+# camera and returns the sharpest as a PIL image, with its metadata
+def capture_sharpest(picam2, frames=5):
+  burst = []
+  for i in range(frames):
+    request = picam2.capture_request()
+    try:
+      burst.append((request.make_array('main'), request.get_metadata()))
+    finally:
+      request.release()
+  array, metadata = burst[pick_sharpest([array for array, metadata in burst])]
+  return picam2.helpers.make_image(array, picam2.camera_config['main']), metadata
+
+
+# Takes a photo the way a build is configured to: with burst_frames > 1,
+# the sharpest of that many frames (see capture_sharpest); otherwise one
+# frame sized for upload_profile (see UPLOAD_PROFILES), or with no
+# profile, the camera's full-size JPEG. Returns the JPEG to upload, the
+# photo to archive (a PIL image, or that same JPEG) and the metadata.
+def take_photo(picam2, burst_frames=1, upload_profile=None):
+  if burst_frames > 1:
+    frame, metadata = capture_sharpest(picam2, burst_frames)
+    return encode_for_upload(frame, **(upload_profile or {})), frame, metadata
+  if upload_profile:
+    return capture_for_upload(picam2, upload_profile)
+  image, metadata = capture_jpeg(picam2)
+  return image, image, metadata
+
+
+# Saves a copy of a photo to archive_dir on a background thread, named
+# after the time it was taken. 'image' is either an in-memory JPEG, which
+# is written as-is, or a PIL image, which is encoded on that thread.
+# Does nothing if archive_dir is None.
+def archive_async(image, archive_dir, now=None):
+  if archive_dir is None:
+    return None
+  now = now or datetime.now()
+  path = os.path.join(archive_dir, now.strftime('image-%Y-%m-%d-%H%M%S.jpg'))
+
+  if isinstance(image, io.BytesIO):
+    data = image.getbuffer() # a view of the JPEG bytes, not a copy
+    def write():
+      with open(path, 'wb') as f:
+        f.write(data)
+  else:
+    def write():
+      image.convert('RGB').save(path, 'JPEG', quality=90)
+
+  thread = threading.Thread(target=write, name='archive', daemon=True)
+  thread.start()
+  return thread
+
+
+# Zero-shutter-lag capture. A background thread keeps copying frames from
+# the running camera into a small ring buffer, so a button press can use
+# the frame from the moment it was pressed instead of waiting for a fresh
+# still capture. Only the chosen frame is ever encoded.
+#
+# The ring holds at most max_frames frames and at most max_bytes of them
+# (whichever is fewer), so memory use stays bounded on a 512 MB Pi. To
+# save CPU, frames are only kept every min_interval seconds; the rest are
+# handed straight back to the camera.
+#
+# That only covers the last max_frames * min_interval seconds, though: a
+# press that waits in the shutter queue behind another would get whatever
+# the camera sees once its turn comes. So hold(when) should be called as
+# soon as a press comes in (see on_accept in shutterqueue.py); it keeps
+# the ring's frames from that moment for frame_at(when). At most max_held
+# presses are held; each holds at most a ring's worth of frames.
+class FrameRing:
+  def __init__(self, picam2, max_frames=4, max_bytes=32 * 1024 * 1024, min_interval=0.1,
+               max_held=2):
+    self.picam2 = picam2
+    self.max_frames = max_frames
+    self.max_bytes = max_bytes
+    self.min_interval = min_interval
+    self.max_held = max_held
+    self.frames = None # deque of (time.monotonic(), array), sized on first frame
+    self.held = {} # press time -> tuple of frames, oldest press first
+    self.lock = threading.Lock()
+    self.ready = threading.Event()
+    self.running = False
+
+  def start(self):
+    self.running = True
+    self.thread = threading.Thread(target=self.run, name='frame-ring', daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.running = False
+    self.thread.join()
+
+  def run(self):
+    last = 0.0
+    while self.running:
+      try:
+        last = self.keep_frame(last)
+      except Exception:
+        # a failed capture mustn't stop the ring, or every later press
+        # would get a stale frame
+        traceback.print_exc()
+        time.sleep(self.min_interval)
+
+  # Takes the next frame from the camera, and keeps it if it's been at
+  # least min_interval since time.monotonic() 'last'; returns the time of
+  # the last frame kept
+  def keep_frame(self, last):
+    request = self.picam2.capture_request()
+    try:
+      now = time.monotonic()
+      if now - last < self.min_interval:
+        return last
+      array = request.make_array('main') # a copy, so the buffer can go back
+    finally:
+      request.release()
+
+    if self.frames is None:
+      frames = max(1, min(self.max_frames, self.max_bytes // array.nbytes))
+      self.frames = deque(maxlen=frames)
+      print('----- FRAME RING: %d frames of %dx%d, %.1f MB' % (
+        frames, array.shape[1], array.shape[0], frames * array.nbytes / 1e6))
+    with self.lock:
+      self.frames.append((now, array))
+    self.ready.set()
+    return now
+
+  # Keeps the frames in the ring right now for a later frame_at(when).
+  # Only references are kept, no copies, so it's cheap enough to call
+  # from a button callback.
+  def hold(self, when):
+    if self.frames is None:
+      return
+    with self.lock:
+      self.held[when] = tuple(self.frames)
+      while len(self.held) > self.max_held:
+        del self.held[next(iter(self.held))]
+
+  # The frame taken closest to 'when' (a time.monotonic() value), as a PIL
+  # image, along with how far off its timestamp was in seconds. With
+  # burst > 1, the sharpest of the 'burst' frames closest to 'when' is
+  # used instead. Uses the frames held for 'when', if there are any.
+  # Warns when even the closest frame is further from 'when' than the
+  # frames span, i.e. the press is older (or newer) than anything kept.
+  # Returns (None, None) if the ring hasn't had a single frame after
+  # 'timeout' seconds, so the caller can take a photo the usual way.
+  def frame_at(self, when, burst=1, timeout=1.0):
+    if not self.ready.wait(timeout):
+      print('----- FRAME RING: no frames after %.1fs' % timeout)
+      return None, None
+    with self.lock:
+      frames = self.held.pop(when, None) or tuple(self.frames)
+    nearest = sorted(frames, key=lambda frame: abs(frame[0] - when))[:burst]
+    taken, array = nearest[0]
+    if len(nearest) > 1:
+      taken, array = nearest[pick_sharpest([array for taken, array in nearest])]
+    span = frames[-1][0] - frames[0][0] + self.min_interval
+    if abs(taken - when) > span:
+      print('----- FRAME RING: WARNING, frame is %.2fs off the press, more than the %.2fs the ring holds' % (
+        taken - when, span))
+    image = self.picam2.helpers.make_image(array, self.picam2.camera_config['main'])
+    return image, taken - when
@@ -0,0 +1,120 @@
+# Hedged, deadline-bounded calls for the remote stages of the pipeline
+# (captioning, the poem). Most calls come back in a few seconds, but now
+# and then one hangs for 20+ while someone stands waiting at the camera.
+#
+# hedged_call() starts a request, and if it hasn't answered by the time
+# that stage usually takes at worst (its p95 so far, see LatencyStats in
+# latency.py), sends a second one -- to the same backend or an alternate --
+# and takes whichever answers first. The other is told to cancel. If
+# nothing has answered by the stage's deadline, DeadlineExceeded is raised.
+#
+# Each attempt is a function taking a threading.Event, which is set once
+# the attempt is no longer wanted. Attempts that can (e.g. by polling)
+# should check it and cancel their request; one that answers after losing
+# has its result passed to discard(), e.g. to close a stream.
+
+import queue, threading, time
+
+
+class DeadlineExceeded(TimeoutError):
+  pass
+
+# raised by attempts that gave up because they were cancelled
+class Cancelled(Exception):
+  pass
+
+
+# End-to-end time budget for one photo; each stage gets at most what's left
+class Deadline:
+  def __init__(self, seconds):
+    self.expires = time.monotonic() + seconds
+
+  def remaining(self):
+    return max(0.0, self.expires - time.monotonic())
+
+
+# Runs fn(cancelled) with a hedge as described above and returns the first
+# result. 'timeout' is the stage's deadline in seconds. The hedge goes to
+# hedge_fn, or to fn again if that's None; it's sent after the stage's
+# 'percentile' latency in 'stats', or after default_delay until there are
+# min_samples to go on -- or straight away if the first attempt fails.
+# Either way it's sent by max_delay (a fraction of the timeout) at the
+# latest: timeouts are recorded as samples, so when many calls are timing
+# out the percentile creeps up to the timeout itself, and the hedge would
+# otherwise stop firing just when it's needed most.
+# The winning latency (or the timeout) is recorded in 'stats' under 'name'.
+def hedged_call(name, fn, stats, timeout, hedge_fn=None, percentile=95,
+                default_delay=5.0, min_samples=10, max_delay=0.5, discard=None):
+  if stats.count(name) >= min_samples:
+    delay = stats.percentile(name, percentile)
+  else:
+    delay = default_delay
+  delay = min(delay, timeout * max_delay)
+  started = time.monotonic()
+  deadline = started + timeout
+  results = queue.Queue()
+  lock = threading.Lock()
+  attempts = [] # cancel events, one per attempt
+  state = {'decided': False}
+
+  def launch(attempt_fn, label):
+    cancelled = threading.Event()
+    attempts.append(cancelled)
+    def run():
+      try:
+        result = attempt_fn(cancelled)
+      except Exception as e:
+        results.put((False, e))
+        return
+      with lock:
+        if not state['decided']:
+          results.put((True, result))
+          return
+      if discard: # answered after losing
+        discard(result)
+    threading.Thread(target=run, name='%s-%s' % (name, label), daemon=True).start()
+
+  def finish():
+    with lock:
+      state['decided'] = True
+    for cancelled in attempts:
+      cancelled.set()
+    # a loser may have answered between the winner and now
+    while not results.empty():
+      ok, result = results.get()
+      if ok and discard:
+        discard(result)
+
+  launch(fn, 'primary')
+  hedged = False
+  running = 1
+  while True:
+    wait_until = deadline if hedged else min(deadline, started + delay)
+    try:
+      ok, result = results.get(timeout=max(0.0, wait_until - time.monotonic()))
+    except queue.Empty:
+      if time.monotonic() >= deadline:
+        finish()
+        stats.record(name, timeout, hedged) # so the tail shows in the percentiles
+        raise DeadlineExceeded('%s took longer than %.1fs' % (name, timeout))
+      print('----- HEDGE: no %s after %.1fs, sending a second request' % (
+        name, time.monotonic() - started))
+      hedged = True
+      running += 1
+      launch(hedge_fn or fn, 'hedge')
+      continue
+
+    running -= 1
+    if ok:
+      finish()
+      stats.record(name, time.monotonic() - started, hedged)
+      return result
+
+    print('----- %s FAILED: %r' % (name.upper(), result))
+    if not hedged:
+      hedged = True
+      running += 1
+      launch(hedge_fn or fn, 'hedge')
+    elif running == 0:
+      finish()
+      raise result
@@ -0,0 +1,97 @@
+# One shared, keep-alive HTTP connection pool for all outbound API traffic
+# (OpenAI, Replicate and the pic_to_poem endpoint), so each photo doesn't
+# pay for DNS, TCP and TLS setup again -- easily hundreds of milliseconds
+# on venue wifi.
+#
+#   openai_client = OpenAI(api_key=..., http_client=httppool.client)
+#   replicate_client = replicate.Client(api_token=..., transport=httppool.transport)
+#   httppool.client.post(api_url, files=files)
+#
+# keep_warm() pings the given servers in the background between shots so
+# their connections don't get closed for being idle.
+#
+# Every request is timed, with the time spent connecting reported
+# separately from the time spent waiting on the server. Only requests
+# that do something are logged, not GETs: those are mostly polls (a
+# Replicate caption checks on its prediction every 0.25s), and would
+# drown out the rest. Set transport.verbose to log them too.
+
+import threading, time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+
+class TimingTransport(httpx.HTTPTransport):
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.verbose = False # log GETs too
+    self.timings = deque(maxlen=200) # recent requests, see handle_request()
+    self.last_used = {} # host -> time.monotonic() of the last request
+
+  # Hooks httpcore's trace events to time each phase of the request
+  def handle_request(self, request):
+    events = {}
+    previous_trace = request.extensions.get('trace')
+    def trace(name, info):
+      # e.g. 'connection.connect_tcp.started', 'http11.send_request_body.complete'
+      events[name.split('.', 1)[1] if name.startswith('http') else name] = time.monotonic()
+      if previous_trace:
+        previous_trace(name, info)
+    request.extensions['trace'] = trace
+
+    started = time.monotonic()
+    response = super().handle_request(request)
+    finished = time.monotonic()
+
+    host = request.url.host
+    self.last_used[host] = finished
+    sent = events.get('send_request_body.complete', started)
+    timing = {
+      'method': request.method,
+      'host': host,
+      'path': request.url.path,
+      'reused': 'connection.connect_tcp.started' not in events,
+      # DNS + TCP + TLS; 0 when an open connection was reused
+      'connect': events.get('connection.start_tls.complete',
+                            events.get('connection.connect_tcp.complete', started)) - started,
+      'upload': sent - events.get('send_request_headers.started', sent),
+      # time to first byte of the response once the request was sent
+      'server': events.get('receive_response_headers.complete', finished) - sent,
+      'total': finished - started,
+    }
+    self.timings.append(timing)
+    if (self.verbose or request.method != 'GET') and not request.extensions.get('keep_warm'):
+      print('----- HTTP %s %s%s: connect %.3fs%s, upload %.3fs, server %.3fs' % (
+        timing['method'], host, timing['path'], timing['connect'],
+        ' (reused)' if timing['reused'] else '', timing['upload'], timing['server']))
+    return response
+
+
+transport = TimingTransport(
+  limits=httpx.Limits(max_connections=10, max_keepalive_connections=5,
+                      keepalive_expiry=120))
+
+# the pic_to_poem endpoint does captioning and GPT in one go, so allow a while
+client = httpx.Client(transport=transport, timeout=httpx.Timeout(60.0, connect=10.0))
+
+
+# Pings each of 'urls' every 'interval' seconds, unless there's been other
+# traffic to it since, to keep a pooled connection open
+def keep_warm(urls, interval=30.0):
+  def ping():
+    while True:
+      time.sleep(interval)
+      for url in urls:
+        host = urlsplit(url).hostname
+        if time.monotonic() - transport.last_used.get(host, 0) < interval:
+          continue
+        try:
+          client.head(url, timeout=10.0, extensions={'keep_warm': True})
+        except httpx.HTTPError as e:
+          print('----- KEEP WARM FAILED: %s (%s)' % (url, e))
+
+  thread = threading.Thread(target=ping, name='keep-warm', daemon=True)
+  thread.start()
+  return thread
@@ -0,0 +1,218 @@
+# Crash-safe journal of photo jobs, so a poem isn't lost when the wifi
+# drops halfway through, or the camera is unplugged before it's printed.
+#
+# Every photo is written to a SQLite file (in WAL mode) as soon as it's
+# taken, and the journal follows it through its stages: captioned, poem
+# written, printed. A job that fails is left in the journal, and
+# JournalWorker keeps retrying it in the background -- backing off
+# exponentially, with jitter, while the network is down -- picking up
+# from the last stage that finished. While the network is down, all the
+# waiting jobs wait together; once one job gets through, the rest are
+# retried straight away, one after another. A job that keeps failing for
+# some other reason is retried on its own schedule, without holding up the
+# others, and given up on after max_attempts. Jobs that were in flight
+# when the camera was switched off are retried after the next boot.
+
+import random, sqlite3, threading, time, traceback
+
+
+class JobJournal:
+  def __init__(self, path, keep_days=7):
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.row_factory = sqlite3.Row
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('PRAGMA synchronous=FULL') # every commit survives a power cut
+    self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+      id INTEGER PRIMARY KEY, taken REAL NOT NULL, image BLOB,
+      caption TEXT, poem TEXT, model TEXT,
+      attempts INTEGER NOT NULL DEFAULT 0, next_try REAL, error TEXT, finished REAL,
+      offline INTEGER NOT NULL DEFAULT 0)''')
+    now = time.time()
+    # jobs in flight when we last stopped (next_try is NULL while a job
+    # is being worked on) are due for a retry
+    self.db.execute('UPDATE jobs SET next_try = ? WHERE finished IS NULL AND next_try IS NULL', (now,))
+    self.db.execute('DELETE FROM jobs WHERE finished < ?', (now - keep_days * 86400,))
+    self.db.commit()
+
+  # Journals a new photo (JPEG bytes, taken at time.time() 'taken');
+  # returns its id. It won't be retried until failed() is called.
+  def add(self, image, taken):
+    with self.lock:
+      cursor = self.db.execute('INSERT INTO jobs (taken, image) VALUES (?, ?)', (taken, image))
+      self.db.commit()
+      return cursor.lastrowid
+
+  # Records stage progress, e.g. update(job_id, caption=caption)
+  def update(self, job_id, **fields):
+    with self.lock:
+      self.db.execute('UPDATE jobs SET %s WHERE id = ?' % ', '.join('%s = ?' % name for name in fields),
+                      list(fields.values()) + [job_id])
+      self.db.commit()
+
+  def get(self, job_id):
+    with self.lock:
+      return dict(self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+  # Marks a job as printed; its photo is dropped to keep the file small
+  def finish(self, job_id):
+    self.update(job_id, finished=time.time(), image=None, error=None)
+
+  # Schedules a failed job's next try, at time.time() 'next_try'. Failures
+  # because we're offline don't count as attempts.
+  def failed(self, job_id, error, next_try, offline=False):
+    with self.lock:
+      self.db.execute('''UPDATE jobs SET attempts = attempts + ?, error = ?, next_try = ?, offline = ?
+        WHERE id = ?''', (0 if offline else 1, error, next_try, int(offline), job_id))
+      self.db.commit()
+
+  # Gives up on a job that keeps failing: it's marked finished, but keeps
+  # its error (and its photo, until it's cleaned up with the rest)
+  def give_up(self, job_id, error):
+    with self.lock:
+      self.db.execute('UPDATE jobs SET attempts = attempts + 1, error = ?, finished = ? WHERE id = ?',
+                      (error, time.time(), job_id))
+      self.db.commit()
+
+  # Ids of unfinished jobs due for a try by time.time() 'now', oldest first
+  def due(self, now):
+    with self.lock:
+      return [row[0] for row in self.db.execute(
+        'SELECT id FROM jobs WHERE finished IS NULL AND next_try <= ? ORDER BY id', (now,))]
+
+  # When the next unfinished job is due, or None if there are none waiting
+  def next_due(self):
+    with self.lock:
+      return self.db.execute('SELECT MIN(next_try) FROM jobs WHERE finished IS NULL').fetchone()[0]
+
+  # Brings forward to time.time() 'now' the next try of every job that's
+  # waiting because we were offline
+  def retry_now(self, now):
+    with self.lock:
+      self.db.execute('UPDATE jobs SET next_try = ? WHERE finished IS NULL AND offline = 1 AND next_try > ?',
+                      (now, now))
+      self.db.commit()
+
+  # Puts off every waiting job's next try until at least 'until'
+  def postpone(self, until):
+    with self.lock:
+      self.db.execute('UPDATE jobs SET next_try = ? WHERE finished IS NULL AND next_try < ?', (until, until))
+      self.db.commit()
+
+  # Unfinished jobs, including any being worked on now
+  def depth(self):
+    with self.lock:
+      return self.db.execute('SELECT COUNT(*) FROM jobs WHERE finished IS NULL').fetchone()[0]
+
+  # Jobs printed since time.time() 'since'
+  def drained(self, since):
+    with self.lock:
+      return self.db.execute('SELECT COUNT(*) FROM jobs WHERE finished >= ? AND error IS NULL',
+                             (since,)).fetchone()[0]
+
+  # Jobs given up on since time.time() 'since'
+  def given_up(self, since):
+    with self.lock:
+      return self.db.execute('SELECT COUNT(*) FROM jobs WHERE finished >= ? AND error IS NOT NULL',
+                             (since,)).fetchone()[0]
+
+
+# Background thread that retries the journal's failed jobs. process(job)
+# gets the job's row as a dict, should pick up from whatever stage it got
+# to (updating the journal as it goes), and returns once the receipt has
+# printed; it raises if the job failed again. Exceptions that are instances
+# of offline_errors (e.g. httpx.TransportError) mean the network is down
+# rather than anything being wrong with the job.
+class JournalWorker:
+  def __init__(self, journal, process, offline_errors=(), base_delay=10.0,
+               max_delay=600.0, max_attempts=5):
+    self.journal = journal
+    self.process = process
+    self.offline_errors = tuple(offline_errors)
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.max_attempts = max_attempts
+    self.offline_failures = 0 # in a row, across all jobs
+    self.wakeup = threading.Event()
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name='journal-worker', daemon=True)
+    thread.start()
+    depth = self.journal.depth()
+    if depth:
+      print('----- JOURNAL: %d unfinished jobs from before, retrying' % depth)
+
+  # How long to wait after a job's attempts-th failure: doubling each time
+  # up to max_delay, with jitter so retries don't all land at once
+  def backoff(self, attempts):
+    delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+  # Call after a failure elsewhere, so the worker sees the new schedule
+  def wake(self):
+    self.wakeup.set()
+
+  # Call when a request got through elsewhere: the network is back, so
+  # retry everything that was waiting for it now
+  def online(self):
+    self.offline_failures = 0
+    if self.journal.next_due() is not None:
+      self.journal.retry_now(time.time())
+      self.wake()
+
+  # Records that a job failed with exception 'error' and schedules its
+  # next try. Returns True if it failed because we're offline, in which
+  # case every other waiting job is put off until then too.
+  def failed(self, job_id, error):
+    if isinstance(error, self.offline_errors):
+      self.offline_failures += 1
+      next_try = time.time() + self.backoff(self.offline_failures)
+      self.journal.failed(job_id, repr(error), next_try, offline=True)
+      self.journal.postpone(next_try)
+      print('----- JOURNAL: offline (%r), next try in %.0fs' % (error, next_try - time.time()))
+      return True
+
+    attempts = self.journal.get(job_id)['attempts'] + 1
+    if attempts >= self.max_attempts:
+      self.journal.give_up(job_id, repr(error))
+      print('----- JOURNAL: giving up on job %d after %d attempts: %r' % (job_id, attempts, error))
+    else:
+      next_try = time.time() + self.backoff(attempts)
+      self.journal.failed(job_id, repr(error), next_try)
+      print('----- JOURNAL: job %d failed (%r), next try in %.0fs' % (
+        job_id, error, next_try - time.time()))
+    return False
+
+  def run(self):
+    while True:
+      next_due = self.journal.next_due()
+      self.wakeup.wait(None if next_due is None else max(0.0, next_due - time.time()))
+      self.wakeup.clear()
+
+      finished = 0
+      for job_id in self.journal.due(time.time()):
+        job = self.journal.get(job_id)
+        if job['finished'] is not None:
+          continue
+        try:
+          self.process(job)
+        except Exception as e:
+          traceback.print_exc()
+          if self.failed(job_id, e):
+            break # still offline; the rest wait along with it
+          continue # just this job; carry on with the others
+        self.journal.finish(job_id)
+        self.offline_failures = 0
+        finished += 1
+      if finished:
+        print('----- JOURNAL: ', self.stats())
+
+  def stats(self):
+    hour_ago = time.time() - 3600
+    drained = self.journal.drained(hour_ago)
+    return {
+      'queue_depth': self.journal.depth(),
+      'drained_last_hour': drained,
+      'given_up_last_hour': self.journal.given_up(hour_ago),
+      'drain_per_minute': round(drained / 60.0, 2),
+    }
@@ -0,0 +1,63 @@
+# Tracks which position the rotary switch (the poem format knob) is in,
+# from gpiozero button events, so nothing has to poll it: reading the
+# position at shutter time is just reading 'position'.
+#
+# Each position is wired to its own pin, which reads as pressed while the
+# knob is there. Turning the knob releases one pin and, a moment later,
+# presses the next; in between no pin is pressed, and position is None.
+# Contacts bounce as the knob moves, so a change only counts once the pins
+# have been quiet for 'settle' seconds. on_change(position) is then called
+# (on a timer thread), e.g. to get that position's prompt ready.
+
+import threading
+
+from gpiozero import Button
+
+
+class KnobTracker:
+  # 'pins' are the GPIO pins for positions 1, 2, ...
+  def __init__(self, pins, settle=0.05, on_change=None):
+    self.settle = settle
+    self.on_change = on_change
+    self.lock = threading.Lock()
+    self.timer = None
+    self.buttons = [Button(pin) for pin in pins]
+
+    # where the knob is once things have settled: a position, or None
+    # between positions. written in one go, so it's safe to read anywhere
+    self.position = None
+    for number, button in enumerate(self.buttons, 1):
+      if button.is_pressed:
+        self.position = number
+    self.last_position = self.position # most recent actual position
+    self.pending = self.position
+
+    # only now that the state above exists can events come in; a knob
+    # turned while starting up is caught by the settle timer as usual
+    for number, button in enumerate(self.buttons, 1):
+      button.when_pressed = lambda number=number: self.moved(number, True)
+      button.when_released = lambda number=number: self.moved(number, False)
+
+  def moved(self, number, pressed):
+    with self.lock:
+      if pressed:
+        self.pending = number
+      elif self.pending == number:
+        self.pending = None
+      # (re)start the settle timer
+      if self.timer:
+        self.timer.cancel()
+      self.timer = threading.Timer(self.settle, self.settled)
+      self.timer.daemon = True
+      self.timer.start()
+
+  def settled(self):
+    with self.lock:
+      if self.pending == self.position:
+        return
+      self.position = self.pending
+      if self.position is not None:
+        self.last_position = self.position
+      position = self.position
+    if self.on_change:
+      self.on_change(position)
@@ -0,0 +1,133 @@
+# Latency tracking for the photo-to-poem pipeline.
+
+import json, math, os, threading, time
+from collections import deque
+from contextlib import contextmanager
+
+
+# Times each stage of one photo's trip through the pipeline, relative to
+# when the shutter was pressed ('start', a time.monotonic() value; now if
+# not given). Stages can run on different threads.
+class StageTimer:
+  def __init__(self, start=None):
+    self.start = time.monotonic() if start is None else start
+    self.stages = []  # (name, started, finished), seconds after start
+    self.lock = threading.Lock()
+
+  @contextmanager
+  def stage(self, name):
+    started = time.monotonic() - self.start
+    try:
+      yield
+    finally:
+      finished = time.monotonic() - self.start
+      with self.lock:
+        self.stages.append((name, started, finished))
+
+  # Records a stage timed elsewhere, from time.monotonic() values
+  def record(self, name, started, finished):
+    with self.lock:
+      self.stages.append((name, started - self.start, finished - self.start))
+
+  # Runs fn(*args) as a stage, e.g. pool.submit(timer.run, 'caption', fn, arg)
+  def run(self, name, fn, *args):
+    with self.stage(name):
+      return fn(*args)
+
+  def report(self):
+    with self.lock:
+      stages = sorted(self.stages, key=lambda s: s[1])
+    print('----- STAGE LATENCY')
+    for name, started, finished in stages:
+      print('%-14s %6.2fs   (%5.2fs -> %5.2fs)' % (name, finished - started, started, finished))
+    print('%-14s %6.2fs' % ('total', time.monotonic() - self.start))
+
+
+# Latency percentiles for each stage across photos (the last 'window'
+# of each), and how often the stage had to be hedged (see hedge.py).
+# With a path, the samples are saved there as JSON after every record()
+# and loaded again at startup, so the numbers -- and the hedge thresholds
+# taken from them -- survive restarts.
+class LatencyStats:
+  def __init__(self, path=None, window=200):
+    self.path = path
+    self.window = window
+    self.samples = {} # name -> deque of seconds
+    self.calls = {}
+    self.hedges = {}
+    self.lock = threading.Lock()
+    self.save_lock = threading.Lock()
+    if path and os.path.exists(path):
+      with open(path) as f:
+        for name, stage in json.load(f).items():
+          self.samples[name] = deque(stage['samples'], maxlen=window)
+          self.calls[name] = stage['calls']
+          self.hedges[name] = stage['hedges']
+
+  def record(self, name, seconds, hedged=False):
+    with self.lock:
+      self.samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+      self.calls[name] = self.calls.get(name, 0) + 1
+      self.hedges[name] = self.hedges.get(name, 0) + hedged
+    if self.path:
+      self.save()
+
+  def count(self, name):
+    with self.lock:
+      return len(self.samples.get(name, ()))
+
+  # The p-th percentile (nearest rank) of a stage's latency, or None
+  def percentile(self, name, p):
+    with self.lock:
+      samples = sorted(self.samples.get(name, ()))
+    if not samples:
+      return None
+    return samples[max(0, math.ceil(p / 100.0 * len(samples)) - 1)]
+
+  def summary(self):
+    with self.lock:
+      names = sorted(self.samples)
+    summary = {}
+    for name in names:
+      summary[name] = {
+        'count': self.count(name),
+        'p50': round(self.percentile(name, 50), 3),
+        'p95': round(self.percentile(name, 95), 3),
+        'p99': round(self.percentile(name, 99), 3),
+        'hedge_rate': round(float(self.hedges[name]) / self.calls[name], 3),
+      }
+    return summary
+
+  def report(self):
+    print('----- LATENCY PERCENTILES')
+    for name, stage in self.summary().items():
+      print('%-14s p50 %5.2fs   p95 %5.2fs   p99 %5.2fs   hedged %3.0f%% of %d' % (
+        name, stage['p50'], stage['p95'], stage['p99'], stage['hedge_rate'] * 100, stage['count']))
+
+  # Writes the raw samples, plus the summary for anyone reading the file
+  def save(self):
+    with self.lock:
+      data = {name: {'samples': list(samples), 'calls': self.calls[name],
+                     'hedges': self.hedges[name]} for name, samples in self.samples.items()}
+    for name, stage in self.summary().items():
+      data[name].update(stage)
+    with self.save_lock:
+      tmp = self.path + '.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+      os.replace(tmp, self.path)
+
+
+# Exponentially weighted moving average: each new value moves the average
+# 'alpha' of the way towards it, so recent calls count the most
+class EWMA:
+  def __init__(self, alpha=0.3, value=None):
+    self.alpha = alpha
+    self.value = value
+
+  def update(self, value):
+    if self.value is None:
+      self.value = value
+    else:
+      self.value += self.alpha * (value - self.value)
+    return self.value
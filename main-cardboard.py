@@ -4,22 +4,41 @@
 # Capture a JPEG while still running in the preview mode. When you
 # capture to a file, the return value is the metadata for that image.
 
-import time, requests, signal, os
+import time, signal, os, httppool
 
 from picamera2 import Picamera2, Preview
 from gpiozero import LED, Button
 from Adafruit_Thermal import *
 from wraptext import *
+from shutterqueue import ShutterQueue
+from capture import take_photo, archive_async, wait_for_convergence, UPLOAD_PROFILES
 from datetime import datetime
 
 #instantiate printer
 printer = Adafruit_Thermal('/dev/serial0', 9600, timeout=5)
 
+# the poem API. uploads go over a keep-alive connection (see httppool.py)
+# that's kept open between photos, so a press doesn't wait on DNS/TCP/TLS setup
+api_url = 'https://poetry-camera.carozee.repl.co/pic_to_poem'
+httppool.keep_warm(['https://poetry-camera.carozee.repl.co/'])
+
+# photos are kept in memory; set this to a directory to also
+# save a copy of each one to disk (in the background)
+archive_dir = None # e.g. '/home/carolynz/CamTest/images'
+
+# how photos are taken (see take_photo in capture.py): the sharpest of
+# burst_frames frames (1 turns burst mode off), shrunk to upload_profile
+# (None uploads the camera's full-size JPEG)
+burst_frames = 5
+upload_profile = UPLOAD_PROFILES['pic_to_poem']
+
 #instantiate camera
 picam2 = Picamera2()
 # start camera
 picam2.start()
-time.sleep(2) # warmup period since first few frames are often poor quality
+# warmup period since first few frames are often poor quality:
+# wait until exposure and white balance settle (at most 2s)
+wait_for_convergence(picam2, timeout=2.0)
 
 # NEXT 3 LINES FOR DEBUGGING: computer preview of image
 # Slows down the program considerably
@@ -36,22 +55,21 @@ power_button = Button(26, hold_time = 2)
 #############################
 # CORE PHOTO-TO-POEM FUNCTION
 #############################
-def take_photo_and_print_poem():
-  # Take photo & save it
-  metadata = picam2.capture_file('/home/carolynz/CamTest/images/image.jpg')
+def take_photo_and_print_poem(pressed_at=None):
+  if pressed_at:
+    print('----- PRESS WAITED %.2fs in the queue' % (time.monotonic() - pressed_at))
+
+  # Take photo, keeping it in memory
+  image, frame, metadata = take_photo(picam2, burst_frames, upload_profile)
 
   # FOR DEBUGGING: print metadata
   #print(metadata)
 
-  # TODO? Takes a photo and saves to memory
-  #image = picam2.capture_image()
-  #print(image)
-
   # Close camera -- commented out because this can only happen at end of program
   # picam2.close()
 
-  # FOR DEBUGGING: note that image has been saved
-  print('----- SUCCESS: image saved locally')
+  # FOR DEBUGGING: note that image has been taken
+  print('----- SUCCESS: image captured')
 
   #######################
   # Receipt printer:
@@ -60,6 +78,7 @@ def take_photo_and_print_poem():
 
   # Get current date+time -- will use for printing and file naming
   now = datetime.now()
+  archive_async(frame, archive_dir, now)
 
   # Format printed datetime like:
   # Jan 1, 2023
@@ -85,22 +104,20 @@ def take_photo_and_print_poem():
   #########################
   # Send saved image to API
   #########################
-  api_url = 'https://poetry-camera.carozee.repl.co/pic_to_poem'
 
   # OLD: get PIL Image object from memory
   # files = {'file': image}
 
-  # Read file that was saved to disk as a byte array
-  with open('/home/carolynz/CamTest/images/image.jpg', 'rb') as f:
-    byte_im = f.read()
-
-    # prep format for API call
-    image_filename = 'rpi-' + now.strftime('%Y-%m-%d-at-%I.%M-%p')
-    files = {'file': (image_filename, byte_im, 'image/jpg')}
+  # prep format for API call, uploading the in-memory JPEG directly
+  image_filename = 'rpi-' + now.strftime('%Y-%m-%d-at-%I.%M-%p')
+  files = {'file': (image_filename, image, 'image/jpg')}
 
   # Send byte array in API
-  response = requests.post(api_url, files=files)
+  upload_started = time.monotonic()
+  response = httppool.client.post(api_url, files=files)
   response_data = response.json()
+  print('----- API RESPONSE: %.2fs for %d KB' % (
+    time.monotonic() - upload_started, image.getbuffer().nbytes // 1024))
 
   # FOR DEBUGGING: print response to console for debugging
   #print(response_data['poem'])
@@ -155,7 +172,12 @@ signal.signal(signal.SIGINT, handle_keyboard_interrupt)
 ################################
 # LISTEN FOR BUTTON PRESS EVENTS
 ################################
-shutter_button.when_pressed = take_photo_and_print_poem
+# presses are queued, and photos taken and printed one at a time on the
+# queue's thread rather than gpiozero's; bounces and double presses are
+# dropped, as are presses while one is already waiting (see shutterqueue.py)
+shutter_queue = ShutterQueue(take_photo_and_print_poem, max_queued=1, policy='reject')
+shutter_queue.start()
+shutter_button.when_pressed = shutter_queue.press
 power_button.when_held = shutdown
 
 signal.pause()
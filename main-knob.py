@@ -4,22 +4,43 @@
 # Capture a JPEG while still running in the preview mode. When you
 # capture to a file, the return value is the metadata for that image.
 
-import time, requests, signal, os
+import time, signal, os, httppool
 
 from picamera2 import Picamera2, Preview
 from gpiozero import LED, Button
 from Adafruit_Thermal import *
 from wraptext import *
+from shutterqueue import ShutterQueue
+from knob import KnobTracker
+from prompts import KNOB_FORMATS
+from capture import take_photo, archive_async, wait_for_convergence, UPLOAD_PROFILES
 from datetime import datetime
 
 #instantiate printer
 printer = Adafruit_Thermal('/dev/serial0', 9600, timeout=5)
 
+# the poem API. uploads go over a keep-alive connection (see httppool.py)
+# that's kept open between photos, so a press doesn't wait on DNS/TCP/TLS setup
+api_url = 'https://poetry-camera.carozee.repl.co/pic_to_poem'
+httppool.keep_warm(['https://poetry-camera.carozee.repl.co/'])
+
+# photos are kept in memory; set this to a directory to also
+# save a copy of each one to disk (in the background)
+archive_dir = None # e.g. '/home/carolynz/CamTest/images'
+
+# how photos are taken (see take_photo in capture.py): the sharpest of
+# burst_frames frames (1 turns burst mode off), shrunk to upload_profile
+# (None uploads the camera's full-size JPEG)
+burst_frames = 5
+upload_profile = UPLOAD_PROFILES['pic_to_poem']
+
 #instantiate camera
 picam2 = Picamera2()
 # start camera
 picam2.start()
-time.sleep(2) # warmup period since first few frames are often poor quality
+# warmup period since first few frames are often poor quality:
+# wait until exposure and white balance settle (at most 2s)
+wait_for_convergence(picam2, timeout=2.0)
 
 # NEXT 3 LINES FOR DEBUGGING: computer preview of image
 # Slows down the program considerably
@@ -33,39 +54,28 @@ time.sleep(2) # warmup period since first few frames are often poor quality
 shutter_button = Button(16)
 power_button = Button(26, hold_time = 2)
 
-# different rotary switch knob positions
-knob1 = Button(17)
-knob2 = Button(27)
-knob3 = Button(22)
-knob4 = Button(5)
-knob5 = Button(6)
-knob6 = Button(13)
-knob7 = Button(19)
-knob8 = Button(25)
-knob9 = Button(24)
-knob10 = Button(23)
-current_knob = None
+# different rotary switch knob positions, in order (see knob.py)
+knob_pins = [17, 27, 22, 5, 6, 13, 19, 25, 24, 23]
 
 
 #############################
 # CORE PHOTO-TO-POEM FUNCTION
 #############################
-def take_photo_and_print_poem():
-  # Take photo & save it
-  metadata = picam2.capture_file('/home/carolynz/CamTest/images/image.jpg')
+def take_photo_and_print_poem(pressed_at=None):
+  if pressed_at:
+    print('----- PRESS WAITED %.2fs in the queue' % (time.monotonic() - pressed_at))
+
+  # Take photo, keeping it in memory
+  image, frame, metadata = take_photo(picam2, burst_frames, upload_profile)
 
   # FOR DEBUGGING: print metadata
   #print(metadata)
 
-  # TODO? Takes a photo and saves to memory
-  #image = picam2.capture_image()
-  #print(image)
-
   # Close camera -- commented out because this can only happen at end of program
   # picam2.close()
 
-  # FOR DEBUGGING: note that image has been saved
-  print('----- SUCCESS: image saved locally')
+  # FOR DEBUGGING: note that image has been taken
+  print('----- SUCCESS: image captured')
 
   #######################
   # Receipt printer:
@@ -77,6 +87,7 @@ def take_photo_and_print_poem():
 
   # Get current date+time -- will use for printing and file naming
   now = datetime.now()
+  archive_async(frame, archive_dir, now)
 
   # Format printed datetime like:
   # Jan 1, 2023
@@ -102,25 +113,23 @@ def take_photo_and_print_poem():
   #########################
   # Send saved image to API
   #########################
-  api_url = 'https://poetry-camera.carozee.repl.co/pic_to_poem'
 
   # OLD: get PIL Image object from memory
   # files = {'file': image}
 
-  # Read file that was saved to disk as a byte array
-  with open('/home/carolynz/CamTest/images/image.jpg', 'rb') as f:
-    byte_im = f.read()
-
-    # prep format for API call
-    image_filename = 'rpi-' + now.strftime('%Y-%m-%d-at-%I.%M-%p')
-    files = {'file': (image_filename, byte_im, 'image/jpg')}
+  # prep format for API call, uploading the in-memory JPEG directly
+  image_filename = 'rpi-' + now.strftime('%Y-%m-%d-at-%I.%M-%p')
+  files = {'file': (image_filename, image, 'image/jpg')}
 
   # Get poem format
   poem_format = get_poem_format()
 
   # Send byte array in API
-  response = requests.post(api_url, files=files, data={'poem_format': poem_format})
+  upload_started = time.monotonic()
+  response = httppool.client.post(api_url, files=files, data={'poem_format': poem_format})
   response_data = response.json()
+  print('----- API RESPONSE: %.2fs for %d KB' % (
+    time.monotonic() - upload_started, image.getbuffer().nbytes // 1024))
 
   # FOR DEBUGGING: print response to console for debugging
   #print(response_data['poem'])
@@ -162,33 +171,32 @@ def shutdown():
 ##################################
 # KNOB: GET POEM FORMAT
 ##################################
+# poem format for each knob position (see prompts.py)
+# note: if no poem format is passed to API,
+# the prompt will default to "2 verses of 4 lines, ABAB rhyme scheme" (knob 1)
+knob_formats = KNOB_FORMATS
+default_format = knob_formats[0]
+
+# the format for the knob's current position, worked out whenever the
+# knob moves rather than when the shutter is pressed. if the knob is
+# between positions, the last position it was in counts
+current_format = default_format
+
+def knob_changed(position):
+  global current_format
+  if position is None:
+    print('----- KNOB: between positions')
+    return
+  current_format = knob_formats[position - 1]
+  print('----- KNOB: position %d, %s' % (position, current_format))
+
+knob = KnobTracker(knob_pins, on_change=knob_changed)
+if knob.last_position:
+  current_format = knob_formats[knob.last_position - 1]
+
+
 def get_poem_format():
-  # default
-  # note: if no poem format is passed to API,
-  # the prompt will default to "2 verses of 4 lines, ABAB rhyme scheme" (knob 1) 
-  poem_format = '8 lines or less, ABAB rhyme scheme'
-
-  if knob1.is_pressed:
-    # default/auto
-    poem_format = '8 lines or less, ABAB rhyme scheme'
-  elif knob2.is_pressed:
-    poem_format = 'haiku'
-  elif knob3.is_pressed:
-    poem_format = 'limerick'
-  elif knob4.is_pressed:
-    poem_format = 'sonnet'
-  elif knob5.is_pressed:
-    poem_format = 'short poem about the people in this scene. what they look like, how they feel, what their stories are. if there are multiple people, what their relationships might be to each other.'
-  elif knob6.is_pressed:
-    poem_format = 'short poem about the landscape, background, or location of this scene'
-  elif knob7.is_pressed:
-    poem_format = 'short poem about the text described in this scene'
-  elif knob8.is_pressed:
-    poem_format = 'short poem in the style of T.S. Eliot'
-  elif knob9.is_pressed:
-    poem_format = 'short poem in the style of William Shakespeare'
-  elif knob10.is_pressed:
-    poem_format = 'short poem in the style of Emily Dickinson'
+  poem_format = current_format
 
   # For debugging
   print('----- POEM FORMAT: ' + poem_format)
@@ -213,10 +221,14 @@ signal.signal(signal.SIGINT, handle_keyboard_interrupt)
 ################################
 # LISTEN FOR BUTTON PRESS EVENTS
 ################################
-shutter_button.when_pressed = take_photo_and_print_poem
+# presses are queued, and photos taken and printed one at a time on the
+# queue's thread rather than gpiozero's; bounces and double presses are
+# dropped, as are presses while one is already waiting (see shutterqueue.py)
+shutter_queue = ShutterQueue(take_photo_and_print_poem, max_queued=1, policy='reject')
+shutter_queue.start()
+shutter_button.when_pressed = shutter_queue.press
 power_button.when_held = shutdown
 
-# knob switch events
-
+# knob switch events are handled by the KnobTracker above
 
 signal.pause()
@@ -4,30 +4,62 @@
 # Capture a JPEG while still running in the preview mode. When you
 # capture to a file, the return value is the metadata for that image.
 
-import time, requests, signal, os, replicate
+import io, itertools, time, requests, signal, os, threading, traceback, replicate, httppool, httpx, openai
 
 from picamera2 import Picamera2, Preview
 from gpiozero import LED, Button
 from Adafruit_Thermal import *
 from wraptext import *
+from printspooler import PrintSpooler
+from receipt import Receipt
+from poemstream import completion_deltas, stream_lines, drop_partial_line, PoemCutOff
+from latency import StageTimer, LatencyStats
+from hedge import hedged_call, Deadline, DeadlineExceeded, Cancelled
+from modelrouter import ModelRouter
+from jobjournal import JobJournal, JournalWorker
+from shutterqueue import ShutterQueue
+from poemcache import PoemCache
+from prompts import compile_templates, count_tokens, FormatReport, KNOB_FORMATS
+from scenehash import dhash
+from speculative import SpeculativeCaptioner
+from captioncache import CaptionCache
+from capture import take_photo, encode_for_upload, archive_async, wait_for_convergence, \
+  FrameRing, UPLOAD_PROFILES
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 from openai import OpenAI
 
 #load API keys from .env
 load_dotenv()
-openai_client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
 REPLICATE_API_TOKEN = os.environ['REPLICATE_API_TOKEN']
 
+# both API clients share one pool of keep-alive connections (see httppool.py),
+# kept open between photos so a press doesn't wait on DNS/TCP/TLS setup
+openai_client = OpenAI(api_key=os.environ['OPENAI_API_KEY'], http_client=httppool.client)
+replicate_client = replicate.Client(api_token=REPLICATE_API_TOKEN, transport=httppool.transport)
+httppool.keep_warm(['https://api.openai.com/v1', 'https://api.replicate.com/v1'])
+
 #instantiate printer
 baud_rate = 9600 # REPLACE WITH YOUR OWN BAUD RATE
 printer = Adafruit_Thermal('/dev/serial0', baud_rate, timeout=5)
 
+# all printing goes through the spooler, which owns the printer
+# and prints queued jobs in the background
+spooler = PrintSpooler(printer)
+
+# threads for pipeline stages that run side by side
+pipeline_pool = ThreadPoolExecutor(max_workers=2)
+
 #instantiate camera
 picam2 = Picamera2()
+# held while taking a photo, so nothing else grabs frames at the same time
+camera_lock = threading.Lock()
 # start camera
 picam2.start()
-time.sleep(2) # warmup period since first few frames are often poor quality
+# warmup period since first few frames are often poor quality:
+# wait until exposure and white balance settle (at most 2s)
+wait_for_convergence(picam2, timeout=2.0)
 
 #instantiate buttons
 shutter_button = Button(16) # REPLACE WTH YOUR OWN BUTTON PINS
@@ -49,16 +81,113 @@ Focus on a unique and elegant poem and use specific ideas and details.
 You must keep vocabulary simple and use understated point of view. This is very important.\n\n"""
 poem_format = "8 line free verse"
 
+# prompts for every format are put together once, up front, along with
+# their token counts and how long a poem in each may be (see prompts.py)
+prompt_templates = compile_templates(system_prompt, prompt_base, [poem_format] + KNOB_FORMATS)
+format_report = FormatReport()
+
+# print each line of the poem as soon as GPT has written it,
+# rather than waiting for the whole poem
+stream_poem = True
+
+# photos are kept in memory; set this to a directory to also
+# save a copy of each one to disk (in the background)
+archive_dir = None # e.g. '/home/carolynz/CamTest/images'
+
+# how photos are taken (see take_photo in capture.py): the sharpest of
+# burst_frames frames (1 turns burst mode off), shrunk to upload_profile
+# (None uploads the camera's full-size JPEG)
+burst_frames = 3
+upload_profile = UPLOAD_PROFILES['blip2']
+
+# zero shutter lag: keep the last few camera frames in memory and use the
+# one from the moment the button was pressed (see FrameRing in capture.py)
+zero_shutter_lag = True
+frame_ring = None
+if zero_shutter_lag:
+  frame_ring = FrameRing(picam2, max_frames=4)
+  frame_ring.start()
+
+# speculative captioning: while the camera is idle, caption what it sees
+# every few seconds, and reuse that caption if the photo shows the same
+# scene (see speculative.py). Costs extra captioning calls, so off by default
+speculative_captions = False
+
+# remember captions of scenes we've already seen, by perceptual hash,
+# so repeat photos of the same thing skip captioning (see captioncache.py).
+# set to None to turn off
+caption_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'captions.db')
+caption_cache = CaptionCache(caption_cache_path) if caption_cache_path else None
+
+# remember the poems GPT wrote for each prompt, and reuse them when the
+# same caption comes round again (a few different poems per prompt, taking
+# turns; see poemcache.py). set to a path, e.g. next to captions.db, to turn on
+poem_cache_path = None
+poem_cache = PoemCache(poem_cache_path) if poem_cache_path else None
+
+# time limits in seconds: each remote stage has its own deadline, within an
+# overall budget per photo. a stage that's slower than usual gets a second,
+# hedged request, and the first answer wins (see hedge.py). per-stage
+# percentiles and hedge rates are kept in latency_stats.json
+photo_budget = 30.0
+# ('poem start' is the wait for the first line when streaming,
+# 'poem' the whole poem when not; percentiles are kept per model)
+stage_deadlines = {'caption': 15.0, 'poem start': 15.0, 'poem': 25.0}
+latency_stats = LatencyStats(
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'latency_stats.json'))
+
+# models that can write the poem, best first, with a rough guess at how
+# many seconds each takes. each photo uses the best one expected to finish
+# within latency_target seconds of the press (see modelrouter.py)
+poem_models = [('gpt-4', 12.0), ('gpt-3.5-turbo', 4.0)]
+latency_target = 20.0
+model_router = ModelRouter(poem_models, latency_target)
+
+# every photo is journaled on disk until its poem has printed, so if the
+# network drops partway through, the poem prints once it's back -- even
+# after a reboot (see jobjournal.py)
+journal = JobJournal(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db'))
+# new photos are journaled on this thread: the insert waits for the SD
+# card, and shouldn't hold up the header
+journal_pool = ThreadPoolExecutor(max_workers=1)
+# how long a retry waits on each API call before giving up until next time
+retry_timeout = 120.0
+
+# presses are queued and photos taken one at a time (see shutterqueue.py).
+# when max_queued presses are already waiting, a new one is either
+# 'reject'ed (the LED flickers) or replaces the oldest waiting ('newest')
+max_queued = 1
+queue_policy = 'reject'
+
 
 #############################
 # CORE PHOTO-TO-POEM FUNCTION
 #############################
-def take_photo_and_print_poem():
+# Stages that don't depend on each other run side by side: the header
+# prints while the photo uploads and gets captioned, and the prompt
+# template is built in the meantime. Each stage's latency is reported
+# once the last line of the receipt has printed.
+def take_photo_and_print_poem(pressed_at=None):
+  pressed_at = pressed_at or time.monotonic()
+  timer = StageTimer(pressed_at)
+  timer.record('queued', pressed_at, time.monotonic())
+  budget = Deadline(photo_budget)
+
   # blink LED in a background thread
   led.blink()
 
-  # Take photo & save it
-  metadata = picam2.capture_file('/home/carolynz/CamTest/images/image.jpg')
+  # Take photo, keeping it in memory
+  with timer.stage('capture'), camera_lock:
+    frame = None
+    if frame_ring:
+      frame, offset = frame_ring.frame_at(pressed_at, burst_frames)
+    if frame is not None:
+      print('----- FRAME FROM %.3fs after press' % offset)
+      image = encode_for_upload(frame, **(upload_profile or {}))
+    else:
+      image, frame, metadata = take_photo(picam2, burst_frames, upload_profile)
+  now = datetime.now()
+  archive_async(frame, archive_dir, now)
 
   # FOR DEBUGGING: print metadata
   #print(metadata)
@@ -66,73 +195,279 @@ def take_photo_and_print_poem():
   # Close camera -- commented out because this can only happen at end of program
   # picam2.close()
 
-  # FOR DEBUGGING: note that image has been saved
-  print('----- SUCCESS: image saved locally')
+  # FOR DEBUGGING: note that image has been taken
+  print('----- SUCCESS: image captured')
+
+  # queue the header so it prints while we wait on the APIs.
+  # the timestamp is taken now, in case earlier receipts are still printing
+  header_job = spooler.submit(print_receipt, compile_header(now))
+
+  # journal the photo meanwhile; it's on disk well before the caption is back
+  job_future = journal_pool.submit(journal.add, image.getvalue(), now.timestamp())
+
+  # reuse a cached or speculative caption if the photo shows the same scene
+  image_caption = None
+  frame_hash = None
+  if caption_cache or speculative:
+    frame_hash = dhash(frame)
+  if caption_cache:
+    image_caption = caption_cache.lookup(frame_hash)
+    print('----- CAPTION CACHE: ', caption_cache.stats())
+  if speculative:
+    speculative.touch()
+    if image_caption is None:
+      image_caption = speculative.lookup(frame_hash)
 
-  print_header()
-
-  #########################
   # Send saved image to API
-  #########################
+  caption_future = None
+  if image_caption is None:
+    caption_future = pipeline_pool.submit(timer.run, 'caption', hedged_caption, image, budget)
+  template = prompt_templates[poem_format]
+  job_id = job_future.result()
+
+  try:
+    if caption_future:
+      image_caption = caption_future.result()
+    else:
+      print('----- REUSING CAPTION')
+    if caption_cache and caption_future:
+      caption_cache.add(frame_hash, image_caption)
+    journal.update(job_id, caption=image_caption)
+    print('caption: ', image_caption)
+    # generate our prompt for GPT
+    prompt = generate_prompt(image_caption, template)
+
+    # Feed prompt to ChatGPT, to create the poem, with whichever model
+    # can still get it done in time
+    model = model_router.choose(time.monotonic() - pressed_at, budget.remaining())
+    with timer.stage('poem'):
+      poem = poem_cache.lookup(system_prompt, prompt, model) if poem_cache else None
+      if poem is not None:
+        # seen this exact prompt before, so skip GPT altogether
+        print('----- POEM CACHE HIT: ', poem_cache.stats())
+        last_job = spooler.submit(print_receipt, compile_poem(poem).extend(footer))
+      else:
+        poem_started = time.monotonic()
+        try:
+          if stream_poem:
+            poem, last_job, cut_off = stream_and_print_poem(prompt, model, template.max_tokens, budget)
+          else:
+            deadline = min(stage_deadlines['poem'], budget.remaining())
+            poem, cut_off = hedged_call(
+              'poem ' + model,
+              lambda cancelled: complete_poem(prompt, model, template.max_tokens, cancelled, deadline),
+              latency_stats, deadline, default_delay=10.0)
+            last_job = spooler.submit(print_receipt, compile_poem(poem).extend(footer))
+        except DeadlineExceeded:
+          model_router.record(model, time.monotonic() - poem_started)
+          raise
+        poem_seconds = time.monotonic() - poem_started
+        model_router.record(model, poem_seconds)
+        format_report.record(poem_format, template.prompt_tokens(image_caption),
+                             count_tokens(poem), poem_seconds)
+        if cut_off:
+          print('----- POEM CUT OFF at %d tokens (%s); dropped its unfinished last line' % (
+            template.max_tokens, poem_format))
+        elif poem_cache:
+          poem_cache.add(system_prompt, prompt, model, poem, poem_seconds)
+    journal.update(job_id, poem=poem, model=model)
+  except Exception as e:
+    # too slow, or offline: leave the job in the journal for the retry
+    # worker, and tell them rather than leave them standing there
+    traceback.print_exc()
+    print('----- JOB %d POSTPONED: %r' % (job_id, e))
+    journal_worker.failed(job_id, e)
+    journal_worker.wake()
+    led.off()
+    spooler.submit(print_receipt, compile_postponed_note().extend(footer))
+    return
+
+  # print for debugging
+  print('--------POEM BELOW-------')
+  print(poem)
+  print('------------------')
+
+  # don't wait for the paper; the next photo can start while this prints
+  led.off()
+  if speculative:
+    speculative.touch()
+
+  # report latencies once the receipt is done
+  def report():
+    last_job.wait()
+    if last_job.error:
+      journal_worker.failed(job_id, last_job.error)
+      journal_worker.wake()
+      return
+    journal.finish(job_id)
+    journal_worker.online() # that went through, so retry anything waiting now
+    timer.record('print header', header_job.started_at, header_job.ended_at)
+    timer.record('print to end', last_job.queued_at, last_job.ended_at)
+    timer.report()
+    latency_stats.report()
+    if poem_cache:
+      print('----- POEM CACHE: ', poem_cache.stats())
+    format_report.report()
+    if speculative:
+      print('----- SPECULATIVE CAPTIONS: ', speculative.stats())
+  threading.Thread(target=report, daemon=True).start()
+
+  return
+
 
-  image_caption = replicate.run(
-    "andreasjansson/blip-2:4b32258c42e9efd4288bb9910bc532a69727f9acd26aa08e175713a0a857a608",
+#########################
+# Send saved image to API
+#########################
+# blip-2 on replicate. polls the prediction itself, rather than using
+# replicate_client.run(), so a hedged duplicate that loses can be
+# cancelled on replicate's side once 'cancelled' is set. with a timeout
+# (in seconds), a prediction that's still not done by then is cancelled
+# and DeadlineExceeded raised
+def caption_image(image, cancelled=None, timeout=None):
+  # each attempt uploads its own copy, since hedges read it at the same time
+  upload = io.BytesIO(image.getvalue())
+  upload.name = image.name
+  prediction = replicate_client.predictions.create(
+    version="4b32258c42e9efd4288bb9910bc532a69727f9acd26aa08e175713a0a857a608", # andreasjansson/blip-2
     input={
-      "image": open("/home/carolynz/CamTest/images/image.jpg", "rb"),
+      "image": upload,
       "caption": True,
     })
+  started = time.monotonic()
+  while prediction.status not in ('succeeded', 'failed', 'canceled'):
+    if cancelled is not None and cancelled.is_set():
+      prediction.cancel()
+      raise Cancelled(prediction.id)
+    if timeout is not None and time.monotonic() - started > timeout:
+      prediction.cancel()
+      raise DeadlineExceeded('caption still %s after %.0fs' % (prediction.status, timeout))
+    time.sleep(0.25)
+    prediction.reload()
+  if prediction.status != 'succeeded':
+    raise RuntimeError('caption %s: %s' % (prediction.status, prediction.error))
+  return prediction.output
+
+
+# caption_image() with a deadline, hedged if it's slow
+def hedged_caption(image, budget):
+  return hedged_call(
+    'caption', lambda cancelled: caption_image(image, cancelled), latency_stats,
+    min(stage_deadlines['caption'], budget.remaining()), default_delay=8.0)
+
+
+# for speculative captioning: the camera's current view, and its caption
+def get_preview_frame():
+  frame = frame_ring.frame_at(time.monotonic())[0] if frame_ring else None
+  if frame is not None:
+    return frame
+  with camera_lock:
+    return picam2.capture_image('main')
+
+def caption_frame(frame):
+  return caption_image(encode_for_upload(frame, **(upload_profile or {})))
 
-  print('caption: ', image_caption)
-  # generate our prompt for GPT
-  prompt = generate_prompt(image_caption)
 
-  # Feed prompt to ChatGPT, to create the poem
-  completion = openai_client.chat.completions.create(
-    model="gpt-4",
+#######################
+# Stream poem from GPT, printing each line as it arrives
+#######################
+# max_tokens caps the poem's length, and so how long it can take
+def create_poem(prompt, model, max_tokens, stream=False, timeout=openai.NOT_GIVEN):
+  return openai_client.chat.completions.create(
+    model=model,
+    max_tokens=max_tokens,
+    timeout=timeout,
     messages=[{
       "role": "system",
       "content": system_prompt
     }, {
       "role": "user",
       "content": prompt
-    }])
+    }],
+    stream=stream)
 
-  # extract poem from full API response
-  poem = completion.choices[0].message.content
 
-  # print for debugging
-  print('--------POEM BELOW-------')
-  print(poem)
-  print('------------------')
-
-  print_poem(poem)
-
-  print_footer()
-  led.off()
-
-  return
+# the poem from a (non-streamed) completion, and whether max_tokens cut it
+# off; if so, its unfinished last line is dropped (and if that was its
+# only line, PoemCutOff is raised)
+def poem_text(completion):
+  poem = completion.choices[0].message.content
+  if completion.choices[0].finish_reason == 'length':
+    return drop_partial_line(poem), True
+  return poem, False
+
+
+# the whole poem in one go, with whether max_tokens cut it off, like
+# poem_text(). it's streamed anyway, so that a hedged duplicate that
+# loses (once 'cancelled' is set) closes its request instead of running,
+# and being billed, to the end; 'timeout' covers a stream that goes quiet
+def complete_poem(prompt, model, max_tokens, cancelled, timeout):
+  stream = create_poem(prompt, model, max_tokens, stream=True, timeout=timeout)
+  finish = {}
+  pieces = []
+  for delta in completion_deltas(stream, finish):
+    if cancelled.is_set():
+      stream.response.close()
+      raise Cancelled(model)
+    pieces.append(delta)
+  poem = ''.join(pieces)
+  if finish.get('reason') == 'length':
+    return drop_partial_line(poem), True
+  return poem, False
+
+
+# opens a poem stream and waits for its first piece of text, which is
+# where GPT's slow starts show up; returns the stream, all its text, and
+# a dict whose 'reason' is the finish_reason once the stream has ended
+def open_poem_stream(prompt, model, max_tokens):
+  stream = create_poem(prompt, model, max_tokens, stream=True)
+  finish = {}
+  deltas = completion_deltas(stream, finish)
+  first = next(deltas, '')
+  return stream, itertools.chain([first], deltas), finish
+
+
+def stream_and_print_poem(prompt, model, max_tokens, budget):
+  # the deadline and hedge cover the wait for the first text; after that
+  # the lines are already printing. a losing stream is closed
+  stream, deltas, finish = hedged_call(
+    'poem start ' + model, lambda cancelled: open_poem_stream(prompt, model, max_tokens), latency_stats,
+    min(stage_deadlines['poem start'], budget.remaining()), default_delay=5.0,
+    discard=lambda result: result[0].response.close())
+
+  # prints the same bytes as compile_poem(), just in pieces
+  receipt = Receipt(printer)
+  receipt.justify('L') # left align poem text
+  spooler.submit(print_receipt, receipt)
+
+  # a poem cut off by max_tokens doesn't get its unfinished last line
+  cut_off = lambda: finish.get('reason') == 'length'
+  lines = []
+  for line in stream_lines(deltas, drop_partial=cut_off):
+    lines.append(line)
+    receipt = Receipt(printer)
+    receipt.print(wrap_text(line, 32))
+    spooler.submit(print_receipt, receipt)
+
+  if cut_off() and not ''.join(lines).strip():
+    # nothing made it to paper; fail, so the job waits in the journal
+    raise PoemCutOff('cut off before the end of its first line')
+
+  receipt = Receipt(printer)
+  receipt.println()
+  last_job = spooler.submit(print_receipt, receipt.extend(footer))
+
+  return '\n'.join(lines), last_job, cut_off()
 
 
 #######################
 # Generate prompt from caption
 #######################
-def generate_prompt(image_description):
-
-  # reminder: prompt_base is global var
-
-  # prompt what type of poem to write
-  prompt_format = "Poem format: " + poem_format + "\n\n"
-
-  # prompt what image to describe
-  prompt_scene = "Scene description: " + image_description + "\n\n"
 
-  # stitch together full prompt
-  prompt = prompt_base + prompt_format + prompt_scene
+# 'template' is the poem format's PromptTemplate (see prompts.py)
+def generate_prompt(image_description, template):
 
-  # idk how to remove the brackets and quotes from the prompt
-  # via custom filters so i'm gonna remove via this janky code lol
-  prompt = prompt.replace("[", "").replace("]", "").replace("{", "").replace(
-    "}", "").replace("'", "")
+  # stitch together full prompt, with the scene description
+  prompt = template.render(image_description)
 
   #print('--------PROMPT BELOW-------')
   #print(prompt)
@@ -141,52 +476,116 @@ def generate_prompt(image_description):
 
 
 ###########################
-# RECEIPT PRINTER FUNCTIONS
+# RECEIPT LAYOUT
+# Receipts are compiled into printer-ready bytes up front (see receipt.py),
+# so the spooler only has to send them
 ###########################
 
-def print_poem(poem):
+def compile_poem(poem):
   # wrap text to 32 characters per line (max width of receipt printer)
   printable_poem = wrap_text(poem, 32)
 
-  printer.justify('L') # left align poem text
-  printer.println(printable_poem)
+  receipt = Receipt(printer)
+  receipt.justify('L') # left align poem text
+  receipt.println(printable_poem)
+  return receipt
 
 
-# print date/time/location header
-def print_header():
-  # Get current date+time -- will use for printing and file naming
-  now = datetime.now()
-
+# date/time/location header
+def compile_header(now):
   # Format printed datetime like:
   # Jan 1, 2023
   # 8:11 PM
-  printer.justify('C') # center align header text
+  receipt = Receipt(printer)
+  receipt.justify('C') # center align header text
   date_string = now.strftime('%b %-d, %Y')
   time_string = now.strftime('%-I:%M %p')
-  printer.println('\n')
-  printer.println(date_string)
-  printer.println(time_string)
+  receipt.println('\n')
+  receipt.println(date_string)
+  receipt.println(time_string)
+  return receipt.extend(header_art)
 
-  # optical spacing adjustments
-  printer.setLineHeight(56) # I want something slightly taller than 1 row
-  printer.println()
-  printer.setLineHeight() # Reset to default (32)
 
-  printer.println("`'. .'`'. .'`'. .'`'. .'`'. .'`")
-  printer.println("   `     `     `     `     `   ")
+# everything below the date/time in the header; never changes
+def compile_header_art():
+  receipt = Receipt(printer)
 
-
-# print footer
-def print_footer():
-  printer.justify('C') # center align footer text
-  printer.println("   .     .     .     .     .   ")
-  printer.println("_.` `._.` `._.` `._.` `._.` `._")
-  printer.println('\n')
-  printer.println(' This poem was written by AI.')
-  printer.println()
-  printer.println('Explore the archives at')
-  printer.println('poetry.camera')
-  printer.println('\n\n\n\n')
+  # optical spacing adjustments
+  receipt.setLineHeight(56) # I want something slightly taller than 1 row
+  receipt.println()
+  receipt.setLineHeight() # Reset to default (32)
+
+  receipt.println("`'. .'`'. .'`'. .'`'. .'`'. .'`")
+  receipt.println("   `     `     `     `     `   ")
+  return receipt
+
+
+# printed instead of a poem when the APIs are too slow to answer, or offline
+def compile_postponed_note():
+  receipt = Receipt(printer)
+  receipt.justify('C')
+  receipt.println(wrap_text('This poem is taking the long way here. It will print as soon as it arrives!', 32))
+  receipt.println()
+  return receipt
+
+
+# footer; never changes
+def compile_footer():
+  receipt = Receipt(printer)
+  receipt.justify('C') # center align footer text
+  receipt.println("   .     .     .     .     .   ")
+  receipt.println("_.` `._.` `._.` `._.` `._.` `._")
+  receipt.println('\n')
+  receipt.println(' This poem was written by AI.')
+  receipt.println()
+  receipt.println('Explore the archives at')
+  receipt.println('poetry.camera')
+  receipt.println('\n\n\n\n')
+  return receipt
+
+
+# compile the static sections once at startup
+header_art = compile_header_art()
+footer = compile_footer()
+
+
+# finishes a journaled job that failed earlier, from whatever stage it got
+# to, and prints it as a whole receipt. runs on the journal worker thread;
+# nothing is in a hurry here, so no hedging or model routing
+def finish_job(job):
+  caption = job['caption']
+  if caption is None:
+    image = io.BytesIO(job['image'])
+    image.name = 'image.jpg'
+    caption = caption_image(image, timeout=retry_timeout)
+    journal.update(job['id'], caption=caption)
+
+  poem = job['poem']
+  if poem is None:
+    model = poem_models[0][0]
+    template = prompt_templates[poem_format]
+    prompt = generate_prompt(caption, template)
+    poem = poem_cache.lookup(system_prompt, prompt, model) if poem_cache else None
+    if poem is None:
+      started = time.monotonic()
+      poem, cut_off = poem_text(create_poem(prompt, model, template.max_tokens, timeout=retry_timeout))
+      if poem_cache and not cut_off:
+        poem_cache.add(system_prompt, prompt, model, poem, time.monotonic() - started)
+    journal.update(job['id'], poem=poem, model=model)
+
+  taken = datetime.fromtimestamp(job['taken'])
+  print('----- PRINTING JOB %d from %s' % (job['id'], taken))
+  print_job = spooler.submit(print_receipt, compile_header(taken).extend(compile_poem(poem)).extend(footer))
+  print_job.wait()
+  if print_job.error:
+    raise print_job.error
+
+
+# runs on the print spooler thread. waits for the printer to get through
+# the receipt, so the job only counts as done once the paper is out
+def print_receipt(printer, receipt):
+  printer.writeCompiled(receipt)
+  printer.timeoutWait()
 
 
 ##############
@@ -216,6 +615,23 @@ signal.signal(signal.SIGINT, handle_keyboard_interrupt)
 #################
 # Button handlers
 #################
+# runs on the shutter queue's thread, one press at a time. if the
+# pipeline fails, the job itself is safe in the journal
+def handle_shutter(pressed_at):
+  try:
+    take_photo_and_print_poem(pressed_at)
+  except Exception:
+    traceback.print_exc()
+    led.off()
+
+# quick flicker when a press is turned away, then back to the busy blink
+def flash_busy():
+  led.blink(on_time=0.05, off_time=0.05, n=5)
+  def restore():
+    if shutter_queue.busy:
+      led.blink()
+  threading.Timer(0.5, restore).start()
+
 def handle_pressed():
   led.on()
   led.off()
@@ -227,10 +643,26 @@ def handle_held():
   shutdown()
 
 
+# errors that mean the network is down, rather than anything wrong with the job
+offline_errors = (httpx.TransportError, openai.APIConnectionError)
+journal_worker = JournalWorker(journal, finish_job, offline_errors)
+journal_worker.start()
+
+# a press that has to wait still gets the frame from when it was pressed
+shutter_queue = ShutterQueue(handle_shutter, max_queued, queue_policy, on_reject=flash_busy,
+                             on_accept=frame_ring.hold if frame_ring else None)
+shutter_queue.start()
+
+speculative = None
+if speculative_captions:
+  speculative = SpeculativeCaptioner(get_preview_frame, caption_frame)
+  speculative.start()
+
+
 ################################
 # LISTEN FOR BUTTON PRESS EVENTS
 ################################
-shutter_button.when_pressed = take_photo_and_print_poem
+shutter_button.when_pressed = shutter_queue.press
 power_button.when_held = shutdown
 
 signal.pause()
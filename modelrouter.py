@@ -0,0 +1,64 @@
+# Picks which model writes the poem, based on how long each has been taking
+# lately. The best model (gpt-4) is also the slowest; when the photo has
+# already used up much of its time -- a slow network, a slow caption -- or
+# the model itself is having a slow day, a faster model is used so the
+# whole trip still fits within the latency target.
+#
+# Each model's latency is tracked as an EWMA (see latency.py). A model that
+# stops being picked stops getting new measurements, so its estimate
+# drifts back towards its starting guess over time (halving the difference
+# every half_life seconds); that way it gets tried again once things have
+# had time to improve, rather than being written off for good.
+
+import threading, time
+
+from latency import EWMA
+
+
+class ModelRouter:
+  # 'models' is a list of (model, guessed seconds), best model first;
+  # 'target' is the end-to-end time to aim for, in seconds after the press
+  def __init__(self, models, target, alpha=0.3, half_life=300.0):
+    self.models = [model for model, guess in models]
+    self.guesses = dict(models)
+    self.averages = {model: EWMA(alpha) for model in self.models}
+    self.updated = {} # model -> time.monotonic() of its last measurement
+    self.target = target
+    self.half_life = half_life
+    self.lock = threading.Lock()
+
+  # How long 'model' is expected to take, in seconds
+  def estimate(self, model):
+    with self.lock:
+      average = self.averages[model].value
+      updated = self.updated.get(model)
+    guess = self.guesses[model]
+    if average is None:
+      return guess
+    weight = 0.5 ** ((time.monotonic() - updated) / self.half_life)
+    return guess + (average - guess) * weight
+
+  # The best model expected to finish within the target, given 'elapsed'
+  # seconds already spent on this photo (and at most 'remaining' left, if
+  # given); the fastest one if none is. Logs the decision.
+  def choose(self, elapsed, remaining=None):
+    budget = self.target - elapsed
+    if remaining is not None:
+      budget = min(budget, remaining)
+    estimates = [(model, self.estimate(model)) for model in self.models]
+    fitting = [model for model, estimate in estimates if estimate <= budget]
+    chosen = fitting[0] if fitting else min(estimates, key=lambda e: e[1])[0]
+    print('----- MODEL: %s (%.1fs left of %.1fs target; estimates %s)' % (
+      chosen, budget, self.target,
+      ', '.join('%s %.1fs' % estimate for estimate in estimates)))
+    return chosen
+
+  def record(self, model, seconds):
+    with self.lock:
+      average = self.averages[model]
+      if average.value is not None:
+        # fold the drift back towards the guess into the average first
+        weight = 0.5 ** ((time.monotonic() - self.updated[model]) / self.half_life)
+        average.value = self.guesses[model] + (average.value - self.guesses[model]) * weight
+      average.update(seconds)
+      self.updated[model] = time.monotonic()
@@ -0,0 +1,79 @@
+# Poem cache, for when the same scene keeps getting photographed: the same
+# caption and poem format make the same prompt, and there's no need to wait
+# on GPT for it again. Poems are stored by a hash of (system prompt,
+# prompt, model).
+#
+# So that a repeated scene doesn't always print the identical poem, each
+# prompt gets up to 'variants' poems: lookups miss (and the poem that
+# comes back is added) until there are that many, after which hits take
+# turns, least recently printed first.
+#
+# Entries live in a small SQLite file so they survive restarts. They
+# expire 'ttl' seconds after being written, and once there are more than
+# max_entries, the least recently used are dropped.
+
+import hashlib, sqlite3, threading, time
+
+
+def prompt_key(system_prompt, prompt, model):
+  return hashlib.sha256('\0'.join((system_prompt, prompt, model)).encode('utf-8')).hexdigest()
+
+
+class PoemCache:
+  def __init__(self, path, variants=3, ttl=30 * 86400, max_entries=1000):
+    self.variants = variants
+    self.ttl = ttl
+    self.max_entries = max_entries
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute('''CREATE TABLE IF NOT EXISTS poems (
+      key TEXT NOT NULL, poem TEXT NOT NULL, seconds REAL NOT NULL,
+      created REAL NOT NULL, last_used REAL NOT NULL)''')
+    self.db.execute('CREATE INDEX IF NOT EXISTS poems_key ON poems (key)')
+    self.db.execute('DELETE FROM poems WHERE created < ?', (time.time() - ttl,))
+    self.db.commit()
+
+    self.hits = 0
+    self.misses = 0
+    self.saved = 0.0
+
+  # A cached poem for this prompt, or None if it should be written afresh
+  def lookup(self, system_prompt, prompt, model):
+    key = prompt_key(system_prompt, prompt, model)
+    now = time.time()
+    with self.lock:
+      rows = self.db.execute(
+        'SELECT rowid, poem, seconds FROM poems WHERE key = ? AND created >= ? ORDER BY last_used',
+        (key, now - self.ttl)).fetchall()
+      if len(rows) < self.variants:
+        self.misses += 1
+        return None
+
+      rowid, poem, seconds = rows[0]
+      self.db.execute('UPDATE poems SET last_used = ? WHERE rowid = ?', (now, rowid))
+      self.db.commit()
+      self.hits += 1
+      self.saved += seconds
+      return poem
+
+  # Adds a poem for this prompt that took 'seconds' to write
+  def add(self, system_prompt, prompt, model, poem, seconds):
+    now = time.time()
+    with self.lock:
+      self.db.execute('INSERT INTO poems VALUES (?, ?, ?, ?, ?)',
+                      (prompt_key(system_prompt, prompt, model), poem, seconds, now, now))
+      self.db.execute('DELETE FROM poems WHERE created < ?', (now - self.ttl,))
+      self.db.execute('''DELETE FROM poems WHERE rowid NOT IN
+        (SELECT rowid FROM poems ORDER BY last_used DESC LIMIT ?)''', (self.max_entries,))
+      self.db.commit()
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'entries': self.db.execute('SELECT COUNT(*) FROM poems').fetchone()[0],
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        'seconds_saved': round(self.saved, 1),
+      }
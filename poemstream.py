@@ -0,0 +1,45 @@
+# Helpers for streaming a poem out of the OpenAI API line by line, so each
+# line can go to the printer as soon as it's finished instead of waiting
+# for the whole completion.
+
+# text pieces from a chat completion created with stream=True. if 'finish'
+# (a dict) is given, finish['reason'] is set to the completion's
+# finish_reason once it arrives -- 'length' if max_tokens cut it off
+def completion_deltas(stream, finish=None):
+  for chunk in stream:
+    if chunk.choices and chunk.choices[0].finish_reason and finish is not None:
+      finish['reason'] = chunk.choices[0].finish_reason
+    if chunk.choices and chunk.choices[0].delta.content:
+      yield chunk.choices[0].delta.content
+
+
+# 'deltas' is any iterable of text pieces; yields each complete line
+# (without its newline) as soon as it has arrived, then whatever is left
+# over once the stream ends. The lines are the same as text.split('\n')
+# on the full text would give -- unless drop_partial() (checked once the
+# stream has ended) is true, in which case the leftover text is dropped,
+# e.g. because the completion was cut off partway through that line.
+def stream_lines(deltas, drop_partial=None):
+  pending = ''
+  for delta in deltas:
+    pending += delta
+    *lines, pending = pending.split('\n')
+    for line in lines:
+      yield line
+  if not (drop_partial and drop_partial()):
+    yield pending
+
+
+# raised for a completion that max_tokens cut off before it finished a
+# single line, so there's no poem to print
+class PoemCutOff(Exception):
+  pass
+
+
+# 'text' without its last line, for a completion that was cut off partway
+# through it. raises PoemCutOff if that leaves nothing
+def drop_partial_line(text):
+  text = text.rsplit('\n', 1)[0] if '\n' in text else ''
+  if not text.strip():
+    raise PoemCutOff('cut off before the end of its first line')
+  return text
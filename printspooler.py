@@ -0,0 +1,62 @@
+# Print spooler: one background thread owns the printer and works through
+# a queue of print jobs in order. Callers (e.g. the shutter button handler)
+# just queue up what they want printed and carry on, instead of being
+# blocked for as long as it takes the paper to physically come out.
+
+import queue, threading, time, traceback
+
+
+# Handle for a queued print job. Callers can poll done() or block on wait().
+class PrintJob:
+  def __init__(self, fn, args):
+    self.fn = fn
+    self.args = args
+    self.result = None
+    self.error = None  # exception raised by the job, if any
+    self.finished = threading.Event()
+    # time.monotonic() when the job was queued, started and ended printing
+    self.queued_at = time.monotonic()
+    self.started_at = None
+    self.ended_at = None
+
+  # True once the job has been printed (or has failed)
+  def done(self):
+    return self.finished.is_set()
+
+  # Blocks until the job has been printed; returns False on timeout
+  def wait(self, timeout=None):
+    return self.finished.wait(timeout)
+
+
+class PrintSpooler:
+  def __init__(self, printer):
+    self.printer = printer
+    self.jobs = queue.Queue()
+    self.thread = threading.Thread(target=self.run_jobs, name='print-spooler', daemon=True)
+    self.thread.start()
+
+  # Queues fn(printer, *args) to run on the spooler thread.
+  # Jobs print strictly in the order they were submitted.
+  def submit(self, fn, *args):
+    job = PrintJob(fn, args)
+    self.jobs.put(job)
+    return job
+
+  # Number of jobs waiting to print (not counting the one printing now)
+  def pending(self):
+    return self.jobs.qsize()
+
+  def run_jobs(self):
+    while True:
+      job = self.jobs.get()
+      job.started_at = time.monotonic()
+      try:
+        job.result = job.fn(self.printer, *job.args)
+      except Exception as e:
+        # keep the spooler alive for the next receipt
+        job.error = e
+        print('----- PRINT JOB FAILED')
+        traceback.print_exc()
+      finally:
+        job.ended_at = time.monotonic()
+        job.finished.set()
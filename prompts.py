@@ -0,0 +1,120 @@
+# Prompt templates for each poem format, compiled once at startup.
+#
+# Everything in a prompt except the scene description is fixed per format,
+# so compile_templates() builds and sanitizes that part up front, and each
+# shot only has to add the caption (PromptTemplate.render()).
+#
+# Prompt length and poem length both drive how long GPT takes, so each
+# template knows how many tokens its fixed part is, and how many tokens a
+# poem in that format should need at most (max_tokens) -- a haiku has no
+# business taking as long as a sonnet. FormatReport keeps track of what
+# each format actually costs.
+#
+# Token counts use tiktoken when it's installed, and an estimate of one
+# token per four characters otherwise.
+
+import math, threading
+
+try:
+  import tiktoken
+  encoding = tiktoken.get_encoding('cl100k_base') # gpt-4 and gpt-3.5-turbo
+except ImportError:
+  encoding = None
+
+
+# the poem formats on the knob, in knob order (see main-knob.py)
+KNOB_FORMATS = [
+  '8 lines or less, ABAB rhyme scheme', # default/auto
+  'haiku',
+  'limerick',
+  'sonnet',
+  'short poem about the people in this scene. what they look like, how they feel, what their stories are. if there are multiple people, what their relationships might be to each other.',
+  'short poem about the landscape, background, or location of this scene',
+  'short poem about the text described in this scene',
+  'short poem in the style of T.S. Eliot',
+  'short poem in the style of William Shakespeare',
+  'short poem in the style of Emily Dickinson',
+]
+
+# the most tokens a poem in each format may take, with some headroom over
+# what it should need, since a poem that hits the limit is cut off (and
+# its unfinished last line dropped); anything not listed gets
+# DEFAULT_MAX_TOKENS
+MAX_TOKENS = {
+  'haiku': 80,
+  'limerick': 150,
+  'sonnet': 400,
+  '8 line free verse': 250,
+  '8 lines or less, ABAB rhyme scheme': 250,
+}
+DEFAULT_MAX_TOKENS = 350
+
+# brackets and quotes confuse GPT, so they're taken out of prompts
+SANITIZE = str.maketrans('', '', "[]{}'")
+
+def sanitize(text):
+  return text.translate(SANITIZE)
+
+
+def count_tokens(text):
+  if encoding:
+    return len(encoding.encode(text))
+  return int(math.ceil(len(text) / 4.0))
+
+
+class PromptTemplate:
+  def __init__(self, poem_format, prompt_base, system_prompt):
+    self.poem_format = poem_format
+    self.max_tokens = MAX_TOKENS.get(poem_format, DEFAULT_MAX_TOKENS)
+    self.prefix = sanitize(prompt_base + 'Poem format: ' + poem_format + '\n\n')
+    # tokens in the system prompt and the fixed part of the prompt
+    self.fixed_tokens = count_tokens(system_prompt) + count_tokens(self.prefix)
+
+  # The whole prompt for a photo with this caption
+  def render(self, caption):
+    return self.prefix + scene(caption)
+
+  # Tokens in the system prompt and the whole prompt for this caption
+  def prompt_tokens(self, caption):
+    return self.fixed_tokens + count_tokens(scene(caption))
+
+
+def scene(caption):
+  return sanitize('Scene description: ' + caption + '\n\n')
+
+
+# Compiles a template for each of 'formats'; returns them by format.
+# Logs each one's token counts.
+def compile_templates(system_prompt, prompt_base, formats):
+  templates = {}
+  for poem_format in formats:
+    templates[poem_format] = PromptTemplate(poem_format, prompt_base, system_prompt)
+  print('----- PROMPT TEMPLATES (%s token counts)' % ('tiktoken' if encoding else 'estimated'))
+  for template in templates.values():
+    print('%5d prompt tokens, max %3d poem tokens: %.40s' % (
+      template.fixed_tokens, template.max_tokens, template.poem_format))
+  return templates
+
+
+# Prompt and poem tokens, and how long the poem took, for each format
+class FormatReport:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.formats = {} # format -> [count, prompt tokens, poem tokens, seconds]
+
+  def record(self, poem_format, prompt_tokens, poem_tokens, seconds):
+    with self.lock:
+      totals = self.formats.setdefault(poem_format, [0, 0, 0, 0.0])
+      for i, value in enumerate((1, prompt_tokens, poem_tokens, seconds)):
+        totals[i] += value
+
+  def report(self):
+    with self.lock:
+      formats = sorted(self.formats.items())
+    if not formats:
+      return
+    print('----- PROMPT TOKENS AND LATENCY BY FORMAT (averages)')
+    for poem_format, (count, prompt_tokens, poem_tokens, seconds) in formats:
+      print('%-24.24s %3d poems  %5.0f prompt tokens  %4.0f poem tokens  %5.2fs' % (
+        poem_format, count, float(prompt_tokens) / count, float(poem_tokens) / count,
+        seconds / count))
@@ -0,0 +1,85 @@
+# Receipt compiler: builds the ESC/POS bytes for a receipt ahead of time,
+# using the same text/command methods as Adafruit_Thermal (justify,
+# setLineHeight, println...), together with an estimate of how long each
+# line takes to print. The finished receipt goes to the printer in one
+# go with printer.writeCompiled(receipt), so printing doesn't redo the
+# encoding and line bookkeeping byte by byte.
+#
+# Sections that never change (like the footer) can be compiled once at
+# startup and spliced into each receipt with extend(). Sections are
+# assumed to start at the beginning of a line, which is always the case
+# when every piece of text ends with println().
+
+from Adafruit_Thermal import textByteTime
+
+
+class Receipt:
+  def __init__(self, printer):
+    # timing calibration and text settings come from the printer
+    self.byteTime     = printer.byteTime
+    self.dotPrintTime = printer.dotPrintTime
+    self.dotFeedTime  = printer.dotFeedTime
+    self.maxColumn    = printer.maxColumn
+    self.charHeight   = printer.charHeight
+    self.lineSpacing  = printer.lineSpacing
+    self.column       = 0
+    self.prevByte     = '\n'
+
+    self.data = bytearray()
+    # (offset, seconds) after each line or command: how far into
+    # the data it ends, and the estimated print time up to that point
+    self.marks = []
+    self.printTime = 0.0
+
+  def mark(self):
+    self.marks.append((len(self.data), self.printTime))
+
+  # Raw printer command, e.g. writeBytes(27, 97, 1)
+  def writeBytes(self, *args):
+    self.data.extend(args)
+    self.printTime += len(args) * self.byteTime
+    self.mark()
+
+  # Text bytes, timed by the driver's own textByteTime()
+  def write(self, text):
+    for c in text:
+      if c == 0x13: continue
+      self.data.append(c)
+      seconds, lineEnded = textByteTime(self, c)
+      self.printTime += seconds
+      if lineEnded:
+        self.mark()
+
+  def print(self, *args):
+    for arg in args:
+      self.write(str(arg).encode('cp437', 'ignore'))
+
+  def println(self, *args):
+    self.print(*args)
+    self.write(b'\n')
+
+  def justify(self, value):
+    c = value.upper()
+    if c == 'C':
+      pos = 1
+    elif c == 'R':
+      pos = 2
+    else:
+      pos = 0
+    self.writeBytes(0x1B, 0x61, pos)
+
+  def setLineHeight(self, val=32):
+    if val < 24: val = 24
+    self.lineSpacing = val - 24
+    self.writeBytes(27, 51, val)
+
+  # Appends an already-compiled section (e.g. a cached footer)
+  def extend(self, other):
+    offset = len(self.data)
+    self.data.extend(other.data)
+    self.marks.extend((offset + end, self.printTime + t) for end, t in other.marks)
+    self.printTime += other.printTime
+    self.lineSpacing = other.lineSpacing
+    self.column      = other.column
+    self.prevByte    = other.prevByte
+    return self
@@ -0,0 +1,43 @@
+# Perceptual hashing, for telling whether two photos show the same scene.
+#
+# dhash() shrinks an image to 9x8 greyscale and records, for each pixel,
+# whether it's brighter than its right-hand neighbour: 64 bits that stay
+# the same under small changes in exposure, noise or framing, but change a
+# lot when the scene does. Two hashes are compared with hamming(), the
+# number of bits that differ; anything under ~10 is usually the same scene.
+
+import io
+
+
+# 'image' is a PIL image, or an image file (open or a path). Open files
+# are rewound afterwards, ready to be uploaded.
+def dhash(image, size=8):
+  from PIL import Image
+  if isinstance(image, Image.Image):
+    small = shrink(image, size)
+  elif isinstance(image, io.IOBase):
+    image.seek(0)
+    small = shrink(Image.open(image), size)
+    image.seek(0)
+  else:
+    small = shrink(Image.open(image), size)
+  pixels = list(small.getdata())
+
+  value = 0
+  for row in range(size):
+    for col in range(size):
+      left = pixels[row * (size + 1) + col]
+      right = pixels[row * (size + 1) + col + 1]
+      value = (value << 1) | (left > right)
+  return value
+
+
+def hamming(a, b):
+  return bin(a ^ b).count('1')
+
+
+def shrink(image, size):
+  from PIL import Image
+  if image.format == 'JPEG':
+    image.draft('L', (size * 8, size * 8)) # let JPEG decoding do most of the shrinking
+  return image.convert('L').resize((size + 1, size), Image.BILINEAR, reducing_gap=2.0)
@@ -0,0 +1,112 @@
+# Queue between the shutter button and the photo-to-poem pipeline.
+#
+# gpiozero calls press() on its own thread for every press, including
+# contact bounce and the accidental double press. Instead of running the
+# pipeline right there -- so two presses meant two pipelines fighting over
+# the camera and the printer -- press() only queues the time of the press,
+# and a single worker thread runs handler(pressed_at) for each in turn.
+#
+# - presses within 'debounce' seconds of the last one are contact bounce
+#   and ignored
+# - presses within 'double_press' seconds of the last accepted press are
+#   taken to be the same press, and dropped
+# - at most max_queued presses wait behind the one being processed. When
+#   that many are waiting, policy 'reject' drops the new press (and calls
+#   on_reject(), e.g. to flash the LED); policy 'newest' drops the oldest
+#   waiting press instead, so the latest one is the one that gets taken.
+#
+# on_accept(pressed_at) is called (on the button's thread) for every press
+# just before it's queued, for anything that has to happen at the moment
+# of the press rather than when its turn comes, e.g. FrameRing.hold().
+
+import threading, time, traceback
+from collections import deque
+
+
+class ShutterQueue:
+  def __init__(self, handler, max_queued=1, policy='reject', debounce=0.05,
+               double_press=1.0, on_reject=None, on_accept=None):
+    if policy not in ('reject', 'newest'):
+      raise ValueError('policy must be reject or newest, not %r' % policy)
+    self.handler = handler
+    self.max_queued = max_queued
+    self.policy = policy
+    self.debounce = debounce
+    self.double_press = double_press
+    self.on_reject = on_reject
+    self.on_accept = on_accept
+
+    self.queue = deque()
+    self.lock = threading.Lock()
+    self.ready = threading.Condition(self.lock)
+    self.busy = False
+    self.last_press = -float('inf')
+    self.last_accepted = -float('inf')
+    self.counts = {'accepted': 0, 'bounced': 0, 'double_pressed': 0, 'rejected': 0, 'replaced': 0}
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name='shutter-queue', daemon=True)
+    thread.start()
+
+  # Button callback, e.g. shutter_button.when_pressed = queue.press.
+  # Returns straight away.
+  def press(self):
+    now = time.monotonic()
+    rejected = False
+    with self.lock:
+      since_last, self.last_press = now - self.last_press, now
+      if since_last < self.debounce:
+        self.counts['bounced'] += 1
+        return
+      if now - self.last_accepted < self.double_press:
+        self.counts['double_pressed'] += 1
+        print('----- SHUTTER: double press ignored')
+        return
+
+      if len(self.queue) >= self.max_queued:
+        if self.policy == 'newest' and self.queue:
+          self.queue.popleft()
+          self.counts['replaced'] += 1
+          print('----- SHUTTER: busy, replacing the oldest waiting press')
+        else:
+          self.counts['rejected'] += 1
+          print('----- SHUTTER: busy, press rejected (%d waiting)' % len(self.queue))
+          rejected = True
+
+      if not rejected:
+        # before the worker can see the press
+        if self.on_accept:
+          self.on_accept(now)
+        self.last_accepted = now
+        self.counts['accepted'] += 1
+        self.queue.append(now)
+        self.ready.notify()
+
+    if rejected and self.on_reject:
+      self.on_reject()
+
+  def run(self):
+    while True:
+      with self.lock:
+        while not self.queue:
+          self.busy = False
+          self.ready.wait()
+        pressed_at = self.queue.popleft()
+        self.busy = True
+      try:
+        self.handler(pressed_at)
+      except Exception:
+        # keep going for the next press
+        traceback.print_exc()
+
+  # Presses waiting, not counting the one being processed
+  def depth(self):
+    with self.lock:
+      return len(self.queue)
+
+  def stats(self):
+    with self.lock:
+      stats = dict(self.counts)
+      stats['waiting'] = len(self.queue)
+      stats['busy'] = self.busy
+      return stats
@@ -0,0 +1,95 @@
+# Speculative captioning. Most of the wait after a press is the captioning
+# call, so while the camera sits idle pointed at something, a background
+# thread captions what it sees every few seconds. When the shutter is
+# pressed and the photo still shows the same scene (by perceptual hash,
+# see scenehash.py), the pipeline can reuse that caption and skip straight
+# to writing the poem.
+#
+# A new caption is only requested when the scene has changed since the
+# last one, and never while a photo is being processed. The trade-off is
+# API calls for captions nobody uses; stats() reports how that's going.
+
+import threading, time, traceback
+
+from scenehash import dhash, hamming
+
+
+class SpeculativeCaptioner:
+  # get_frame() returns the camera's current view as a PIL image;
+  # caption_fn(frame) returns its caption
+  def __init__(self, get_frame, caption_fn, interval=5.0, threshold=10, idle_time=10.0):
+    self.get_frame = get_frame
+    self.caption_fn = caption_fn
+    self.interval = interval
+    self.threshold = threshold # max differing hash bits for "same scene"
+    self.idle_time = idle_time # seconds after the last press before captioning
+    self.last_active = 0.0
+
+    self.lock = threading.Lock()
+    self.current = None # (hash, caption, seconds the caption took)
+    self.current_used = False
+    self.calls = 0
+    self.hits = 0
+    self.misses = 0
+    self.wasted = 0
+    self.saved = 0.0
+
+  def start(self):
+    thread = threading.Thread(target=self.run, name='speculative-caption', daemon=True)
+    thread.start()
+
+  # Call when a photo starts and finishes processing; captioning pauses
+  # until idle_time after the latest call, so it won't compete with
+  # the pipeline for the camera or the network
+  def touch(self):
+    self.last_active = time.monotonic()
+
+  def run(self):
+    while True:
+      time.sleep(self.interval)
+      if time.monotonic() - self.last_active < self.idle_time:
+        continue
+      try:
+        frame = self.get_frame()
+        frame_hash = dhash(frame)
+        with self.lock:
+          if self.current and hamming(frame_hash, self.current[0]) <= self.threshold:
+            continue # same scene, caption still good
+
+        started = time.monotonic()
+        caption = self.caption_fn(frame)
+        took = time.monotonic() - started
+        with self.lock:
+          self.calls += 1
+          if self.current and not self.current_used:
+            self.wasted += 1
+          self.current = (frame_hash, caption, took)
+          self.current_used = False
+        print('----- SPECULATIVE CAPTION (%.1fs): %s' % (took, caption))
+      except Exception:
+        # e.g. no network; try again next time round
+        traceback.print_exc()
+
+  # The speculative caption, if the photo with hash 'frame_hash' shows
+  # the same scene it was made from; otherwise None
+  def lookup(self, frame_hash):
+    with self.lock:
+      if self.current and hamming(frame_hash, self.current[0]) <= self.threshold:
+        self.hits += 1
+        self.saved += self.current[2]
+        self.current_used = True
+        return self.current[1]
+      self.misses += 1
+      return None
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'calls': self.calls,
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        'wasted_calls': self.wasted,
+        'seconds_saved': round(self.saved, 1),
+      }
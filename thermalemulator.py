@@ -0,0 +1,380 @@
+# ESC/POS thermal printer emulator, for benchmarking and testing the print
+# path without a printer on /dev/serial0. It opens a pseudo-terminal that
+# Adafruit_Thermal can use in place of the real serial port:
+#
+#   emulator = ThermalEmulator(baudrate=19200)
+#   printer = Adafruit_Thermal(emulator.port, 19200)
+#   printer.println('hello')
+#   emulator.settle()
+#   emulator.render('receipt.png')
+#   print(emulator.stats())
+#
+# The emulator decodes the commands the driver sends (ESC @, ESC 7, DC2 #,
+# ESC a, ESC 3, DC2 *, GS h, GS k, ...) and keeps a list of what was
+# printed, which render() draws to a PNG (requires Pillow).
+#
+# It also models the printer's input buffer. Bytes arrive at the serial
+# line rate, and the printer works through them at the given dot print and
+# feed times, one line / bitmap row / feed at a time. If the host sends
+# faster than the printer prints, the buffer fills; any byte arriving with
+# the buffer already full counts as an overrun (a real printer would drop
+# or garble it).
+#
+# Run directly to print a sample receipt: python thermalemulator.py out.png
+
+import os, sys, tty, time, select, threading
+from collections import Counter, deque
+
+ESC, DC2, GS = 27, 18, 29
+
+# (lead byte, command byte) -> name, for stats
+COMMAND_NAMES = {
+  (ESC, 64): 'ESC @', (ESC, 55): 'ESC 7', (ESC, 68): 'ESC D', (ESC, 33): 'ESC !',
+  (ESC, 97): 'ESC a', (ESC, 51): 'ESC 3', (ESC, 50): 'ESC 2', (ESC, 100): 'ESC d',
+  (ESC, 74): 'ESC J', (ESC, 45): 'ESC -', (ESC, 61): 'ESC =', (ESC, 56): 'ESC 8',
+  (ESC, 118): 'ESC v', (ESC, 82): 'ESC R', (ESC, 116): 'ESC t', (ESC, 32): 'ESC SP',
+  (DC2, 35): 'DC2 #', (DC2, 42): 'DC2 *', (DC2, 84): 'DC2 T',
+  (GS, 104): 'GS h', (GS, 72): 'GS H', (GS, 119): 'GS w', (GS, 107): 'GS k',
+  (GS, 33): 'GS !', (GS, 66): 'GS B', (GS, 114): 'GS r',
+}
+
+# total length of fixed-length commands, including the two command bytes
+COMMAND_LENGTHS = {
+  (ESC, 64): 2, (ESC, 55): 5, (ESC, 33): 3, (ESC, 97): 3, (ESC, 51): 3,
+  (ESC, 50): 2, (ESC, 100): 3, (ESC, 74): 3, (ESC, 45): 3, (ESC, 61): 3,
+  (ESC, 118): 3, (ESC, 82): 3, (ESC, 116): 3, (ESC, 32): 3,
+  (DC2, 35): 3, (DC2, 84): 2,
+  (GS, 104): 3, (GS, 72): 3, (GS, 119): 3, (GS, 33): 3, (GS, 66): 3, (GS, 114): 3,
+}
+
+PAPER_WIDTH = 384 # dots
+
+
+class ThermalEmulator:
+  def __init__(self, baudrate=19200, dotPrintTime=0.03, dotFeedTime=0.0021,
+               bufferSize=4096, firmware=268):
+    self.byteTime = 11.0 / float(baudrate) # same framing estimate as the driver
+    self.dotPrintTime = dotPrintTime
+    self.dotFeedTime = dotFeedTime
+    self.bufferSize = bufferSize
+    self.firmware = firmware
+
+    self.master, self.slave = os.openpty()
+    tty.setraw(self.slave) # no newline translation etc.
+    self.port = os.ttyname(self.slave)
+
+    self.lock = threading.Lock()
+    self.items = []    # what has been printed, in order (see render())
+    self.command = bytearray()
+    self.commands = Counter()
+    self.bytesReceived = 0
+    self.overruns = 0
+    self.peakBuffer = 0
+    self.lastReceived = None
+    self.reset()
+
+    # buffer model: completion time of every byte still in the buffer
+    self.pending = deque()
+    self.lastArrival = 0.0
+    self.lastFinish = 0.0
+
+    self.running = True
+    self.thread = threading.Thread(target=self.read_loop, name='thermal-emulator', daemon=True)
+    self.thread.start()
+
+  # printer state after ESC @
+  def reset(self):
+    self.justify = 'L'
+    self.printMode = 0
+    self.size = 0
+    self.charHeight = 24
+    self.maxColumn = 32
+    self.lineSpacing = 8
+    self.inverse = False
+    self.underline = 0
+    self.barcodeHeight = 50
+    self.line = bytearray()
+
+  def close(self):
+    self.running = False
+    self.thread.join()
+    os.close(self.master)
+    os.close(self.slave)
+
+  # Waits until nothing has arrived for 'quiet' seconds
+  def settle(self, quiet=0.2, timeout=60):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+      last = self.lastReceived
+      if last is not None and time.monotonic() - last >= quiet:
+        return True
+      time.sleep(quiet / 4)
+    return False
+
+  def read_loop(self):
+    while self.running:
+      ready, _, _ = select.select([self.master], [], [], 0.05)
+      if not ready:
+        continue
+      try:
+        data = os.read(self.master, 65536)
+      except OSError:
+        break
+      now = time.monotonic()
+      with self.lock:
+        self.lastReceived = now
+        for b in data:
+          self.receive(b, now)
+
+  #######################
+  # Buffer model
+  #######################
+
+  # Each byte arrives no sooner than one byte time after the previous one,
+  # and finishes once the printer has done whatever work it completes
+  # (printing a line, a bitmap row...) on top of everything before it.
+  def receive(self, b, now):
+    arrival = max(now, self.lastArrival + self.byteTime)
+    self.lastArrival = arrival
+    while self.pending and self.pending[0] <= arrival:
+      self.pending.popleft()
+    if len(self.pending) >= self.bufferSize:
+      self.overruns += 1
+    self.bytesReceived += 1
+
+    cost = self.decode(b)
+    self.lastFinish = max(arrival, self.lastFinish) + cost
+    self.pending.append(self.lastFinish)
+    self.peakBuffer = max(self.peakBuffer, len(self.pending))
+
+  #######################
+  # Command decoding
+  #######################
+
+  # Handles one byte; returns the seconds of printer work it completes
+  def decode(self, b):
+    if self.command:
+      self.command.append(b)
+      cost = self.bitmap_row()
+      length = self.command_length()
+      if length is None or len(self.command) < length:
+        return cost
+      command = bytes(self.command)
+      self.command = bytearray()
+      return cost + self.execute(command)
+
+    if b in (ESC, DC2, GS):
+      self.command.append(b)
+      return 0.0
+    if b == 10:
+      return self.end_line()
+    if b == 9:
+      for i in range(4 - len(self.line) % 4):
+        self.decode(32)
+      return 0.0
+    if b < 32 or b == 255: # CR, FF, wake byte etc.
+      return 0.0
+
+    cost = 0.0
+    if len(self.line) >= self.maxColumn:
+      cost = self.end_line() # wrap
+    self.line.append(b)
+    return cost
+
+  # Bitmaps print as they arrive, a row at a time: while a DC2 * is being
+  # received, returns the print time of the row its last byte completed
+  def bitmap_row(self):
+    command = self.command
+    if len(command) <= 4 or (command[0], command[1]) != (DC2, 42) or not command[3]:
+      return 0.0
+    if (len(command) - 4) % command[3]:
+      return 0.0
+    return self.dotPrintTime
+
+  # Total length of the command being received, or None if that isn't
+  # known yet (or the command is variable length and not finished)
+  def command_length(self):
+    command = self.command
+    if len(command) < 2:
+      return None
+    key = (command[0], command[1])
+    if key in COMMAND_LENGTHS:
+      return COMMAND_LENGTHS[key]
+    if key == (ESC, 56): # sleep after: 16-bit seconds on newer firmware
+      return 4 if self.firmware >= 264 else 3
+    if key == (ESC, 68): # tab stops: NUL-terminated list
+      return len(command) if len(command) > 2 and command[-1] == 0 else None
+    if key == (DC2, 42): # bitmap: rows, row bytes, data
+      if len(command) < 4:
+        return None
+      return 4 + command[2] * command[3]
+    if key == (GS, 107): # barcode
+      if self.firmware >= 264:
+        return 4 + command[3] if len(command) >= 4 else None
+      return len(command) if len(command) > 3 and command[-1] == 0 else None
+    return 2 # unknown command; skip its command byte
+
+  def execute(self, command):
+    key = (command[0], command[1])
+    self.commands[COMMAND_NAMES.get(key, 'unknown')] += 1
+    cost = 0.0
+
+    if key == (ESC, 64):
+      self.reset()
+    elif key == (ESC, 97):
+      self.justify = 'LCR'[min(command[2], 2)]
+    elif key == (ESC, 51):
+      self.lineSpacing = max(command[2] - 24, 0)
+    elif key == (ESC, 50):
+      self.lineSpacing = 8
+    elif key == (ESC, 33):
+      self.printMode = command[2]
+      self.set_size(bool(command[2] & (1 << 5)), bool(command[2] & (1 << 4)))
+    elif key == (GS, 33):
+      self.size = command[2]
+      self.set_size(bool(command[2] & 0x10), bool(command[2] & 0x01))
+    elif key == (GS, 66):
+      self.inverse = bool(command[2])
+    elif key == (ESC, 45):
+      self.underline = command[2]
+    elif key == (GS, 104):
+      self.barcodeHeight = command[2]
+    elif key == (ESC, 100):
+      dots = command[2] * (self.charHeight + self.lineSpacing)
+      cost = self.feed(dots)
+    elif key == (ESC, 74):
+      cost = self.feed(command[2])
+    elif key == (DC2, 42):
+      rows, rowBytes = command[2], command[3]
+      self.items.append(('bitmap', rowBytes, rows, command[4:]))
+      # (already charged row by row, see bitmap_row())
+    elif key == (GS, 107):
+      if self.firmware >= 264:
+        text = command[4:]
+      else:
+        text = command[3:-1]
+      self.items.append(('barcode', text.decode('cp437'), self.barcodeHeight))
+      cost = (self.barcodeHeight + 40) * self.dotPrintTime
+    elif key == (DC2, 84):
+      cost = self.dotPrintTime * 24 * 26 + self.dotFeedTime * (6 * 26 + 30)
+    elif key in ((ESC, 118), (GS, 114)):
+      # status request: report paper present
+      os.write(self.master, b'\x00')
+    return cost
+
+  def set_size(self, doubleWidth, doubleHeight):
+    self.charHeight = 48 if doubleHeight else 24
+    self.maxColumn = 16 if doubleWidth else 32
+
+  def end_line(self):
+    if not self.line:
+      return self.feed(self.charHeight + self.lineSpacing)
+    self.items.append(('text', self.line.decode('cp437'), self.justify, self.charHeight,
+                       self.maxColumn, self.lineSpacing, self.inverse, self.underline))
+    self.line = bytearray()
+    return self.charHeight * self.dotPrintTime + self.lineSpacing * self.dotFeedTime
+
+  def feed(self, dots):
+    self.items.append(('feed', dots))
+    return dots * self.dotFeedTime
+
+  #######################
+  # Results
+  #######################
+
+  def stats(self):
+    with self.lock:
+      return {
+        'bytes': self.bytesReceived,
+        'commands': dict(self.commands),
+        'overruns': self.overruns,
+        'peak_buffer_bytes': self.peakBuffer,
+        'buffer_size': self.bufferSize,
+        'paper_dots': sum(self.item_height(item) for item in self.items),
+        # monotonic time at which the modelled printer finishes printing
+        'print_end': self.lastFinish,
+      }
+
+  def item_height(self, item):
+    kind = item[0]
+    if kind == 'text':
+      return item[3] + item[5]
+    if kind == 'bitmap':
+      return item[2]
+    if kind == 'barcode':
+      return item[2] + 40
+    return item[1]
+
+  # Draws everything printed so far to a PNG, PAPER_WIDTH dots wide
+  def render(self, path):
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+    with self.lock:
+      items = list(self.items)
+    height = max(sum(self.item_height(item) for item in items), 1)
+    paper = Image.new('1', (PAPER_WIDTH, height), 1)
+    draw = ImageDraw.Draw(paper)
+    font = ImageFont.load_default()
+
+    y = 0
+    for item in items:
+      kind = item[0]
+      if kind == 'text':
+        text, justify, charHeight, maxColumn, lineSpacing, inverse, underline = item[1:]
+        # draw monospaced at the font's own size, then scale to the
+        # printer's character cells
+        cell = Image.new('1', (max(len(text), 1) * 8, 12), 1)
+        cellDraw = ImageDraw.Draw(cell)
+        for i, c in enumerate(text):
+          cellDraw.text((i * 8 + 1, 0), c, font=font, fill=0)
+        width = min(len(text) * PAPER_WIDTH // maxColumn, PAPER_WIDTH)
+        cell = cell.resize((max(width, 1), charHeight), Image.NEAREST)
+        if inverse:
+          cell = ImageOps.invert(cell.convert('L')).convert('1')
+        x = {'L': 0, 'C': (PAPER_WIDTH - width) // 2, 'R': PAPER_WIDTH - width}[justify]
+        paper.paste(cell, (x, y))
+        if underline:
+          draw.rectangle((x, y + charHeight - underline, x + width - 1, y + charHeight - 1), fill=0)
+      elif kind == 'bitmap':
+        rowBytes, rows, data = item[1:]
+        # printer bitmaps use 1 for black, PIL's mode '1' uses 1 for white
+        data = bytes(data).translate(bytes(255 - i for i in range(256)))
+        paper.paste(Image.frombytes('1', (rowBytes * 8, rows), data), (0, y))
+      elif kind == 'barcode':
+        text, barHeight = item[1:]
+        # not a real symbology, just bars from the bits of the text
+        x = (PAPER_WIDTH - len(text) * 24) // 2
+        for c in text.encode('cp437'):
+          for bit in range(8):
+            if c & (0x80 >> bit):
+              draw.rectangle((x, y, x + 2, y + barHeight - 1), fill=0)
+            x += 3
+        draw.text(((PAPER_WIDTH - draw.textlength(text, font=font)) // 2, y + barHeight + 12),
+                  text, font=font, fill=0)
+      y += self.item_height(item)
+
+    paper.save(path)
+
+
+# Sample receipt through the real driver
+if __name__ == '__main__':
+  from Adafruit_Thermal import Adafruit_Thermal
+
+  output = sys.argv[1] if len(sys.argv) > 1 else 'receipt.png'
+  emulator = ThermalEmulator(baudrate=19200)
+  printer = Adafruit_Thermal(emulator.port, 19200)
+  printer.justify('C')
+  printer.doubleHeightOn()
+  printer.println('Poetry Camera')
+  printer.doubleHeightOff()
+  printer.println("`'. .'`'. .'`'. .'`'. .'`'. .'`")
+  printer.justify('L')
+  printer.println('A camera that prints poems')
+  printer.println('of what it sees.')
+  printer.printBarcode('POETRY', printer.CODE39)
+  printer.feed(2)
+  emulator.settle()
+  emulator.render(output)
+  print(emulator.stats())
+  printer.close()
+  emulator.close()